@@ -1,21 +1,41 @@
+from __future__ import annotations # hints can name classes defined further down
+import time
+PROCESS_START = time.perf_counter()
+import contextlib
+import cProfile
 import ctypes
+import hashlib
 import logging
+import multiprocessing
 import os
+import queue
 import subprocess
-import time
+import threading
+import zipfile
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from dataclasses import dataclass, field
 from enum import Enum, auto
-from typing import Dict, List, Optional, Tuple
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 import json
 import os
 import click
 import cv2
 import mss
-import mss.tools
 import numpy as np
-import win32api
-import win32con
-import win32gui
-from win32com.client import Dispatch
+try:
+    import win32api
+    import win32con
+    import win32gui
+    import win32process
+except ImportError: # not on windows, only replay backends are usable
+    win32api = win32con = win32gui = win32process = None
+try:
+    import psutil
+except ImportError: # optional, only needed for --browser-memory-budget
+    psutil = None
 
 # change them if something not working
 BUTTON_ASSETS = {
@@ -27,6 +47,28 @@ BUTTON_ASSETS = {
     "staging": ["StagingButton.png", "StagingButton2.png", "StagingButton3.png"]
 }
 ASSET_DIRECTORY = "assets"
+# decoded templates plus derived forms, keyed by the asset file hashes; rebuilt for assets that changed
+TEMPLATE_CACHE_FILE = "template_cache.bin"
+# Display scaling / browser zoom: when a state times out, its buttons are searched once at these scales
+# (relative to the assets) and the winning scale of each window and monitor is kept in SCALE_CACHE_FILE
+# once a button was found at it
+SCALE_CALIBRATION: bool = True
+CALIBRATION_SCALES = (0.67, 0.75, 0.8, 0.9, 1.0, 1.1, 1.25, 1.5, 1.75, 2.0)
+CALIBRATION_ATTEMPTS: int = 3 # per window and run, a button that just isn't there shouldn't cost more
+CALIBRATION_MARGIN: float = 0.05 # a scale has to beat the best score at the asset size by this much (look-alikes)
+SCALE_CACHE_FILE = "scale_cache.json"
+# Best score of every template search, per button key and variant, counted in SCORE_BINS bins over 0..1 and
+# kept across runs in SCORE_HISTOGRAM_FILE; --tune-thresholds turns them into per-key thresholds in THRESHOLD_FILE
+SCORE_BINS: int = 100
+SCORE_HISTOGRAM_FILE = "score_histograms.json"
+THRESHOLD_FILE = "thresholds.json"
+TUNE_MARGIN: float = 0.03 # a proposed threshold is at least this far from the button and the background scores
+TUNE_MIN_HITS: int = 5 # button scores a key needs before it is tuned
+TUNE_FLOOR: float = 0.6 # never propose anything lower
+TUNE_MAX_LOWER: float = 0.1 # nor more than this below the current threshold, a look-alike can score like a missed button
+# window each button is drawn in, it decides which calibrated scale the button's templates use
+BUTTON_WINDOWS = {"vortex_dl": "vortex", "vortex_cont": "vortex", "understood": "vortex", "staging": "vortex",
+                  "web_dl": "browser", "click_here": "browser"}
 
 
 # leave as is
@@ -38,6 +80,44 @@ CLICK_HERE_MATCH_THRESHOLD: float = 0.9 #continue button for a case when vortex
 UNDERSTOOD_MATCH_THRESHOLD: float = 0.9
 STAGING_MATCH_THRESHOLD: float = 0.9
 
+# Matcher per button key: "full" matches at full resolution, "pyramid" finds candidates on a
+# downscaled frame first and confirms only those at full resolution, "gray" finds candidates on a
+# grayscale frame and confirms them with the colour template
+MATCHER_MODES: Dict[str, str] = {key: "full" for key in BUTTON_ASSETS}
+MATCHER_CHOICES = ("full", "pyramid", "gray")
+PYRAMID_FACTOR: int = 2 # downscale factor of the coarse level
+PYRAMID_COARSE_MARGIN: float = 0.15 # coarse candidates need threshold - margin
+PYRAMID_CANDIDATES: int = 3 # how many coarse peaks get confirmed at full resolution
+PYRAMID_MIN_TEMPLATE_SIDE: int = 12 # templates smaller than this at the coarse level fall back to full matching
+GRAY_PREFILTER_THRESHOLD: float = 0.75 # grayscale score a spot needs to be confirmed in colour
+GRAY_CANDIDATES: int = 3 # how many grayscale peaks get confirmed
+# Threads matching templates in parallel (cv2 releases the GIL), 1 = match serially
+DETECTION_WORKERS: int = min(8, os.cpu_count() or 1)
+# Worker processes matching per-monitor tiles of the frame, which lives in shared memory ("full" matcher), 0 = match here
+MATCH_PROCESSES: int = 0
+TILE_MIN_AREA: int = 1_000_000 # smaller search areas stay in this process, the round trip would cost more than it saves
+# Recent hit locations remembered per button key and the margin (px) searched around them
+HIT_CACHE_SIZE: int = 4
+HIT_CACHE_RADIUS: int = 16
+# Duplicate clicks: a match of a button at the spot it was clicked at less than CLICK_COOLDOWN seconds ago is ignored
+# while the screen around it hasn't changed (a stale "click here" after CLICK_NEXT, a dialog fading out after its click)
+CLICK_COOLDOWN: float = 3.0
+CLICK_RADIUS: int = 8 # px
+CLICK_SIGNATURE_SIZE: int = 16 # the button and half its size around it, as a gray thumbnail this many px square
+CLICK_SIGNATURE_THRESHOLD: float = 4.0 # mean difference (0-255) of two thumbnails that counts as a change
+# Capture only the windows a state looks at instead of the whole virtual desktop
+WINDOW_SCOPED_CAPTURE: bool = True
+# Frame change detection: tiles whose mean colour moved more than CHANGE_THRESHOLD (0-255, 0 disables)
+# since the last full scan are re-matched, unchanged frames are not matched at all
+CHANGE_TILE_SIZE: int = 32
+CHANGE_THRESHOLD: float = 3.0
+CHANGE_FULL_SCAN_EVERY: int = 20 # force a full scan after this many partial/skipped frames
+CHANGE_MAX_REGIONS: int = 6 # more dirty regions than this are merged into one
+# Background capture: a producer thread grabs into a ring of preallocated frames, one frame ahead of the state machine
+CAPTURE_THREAD: bool = False
+CAPTURE_RING_SIZE: int = 3 # newest frame + frame held by the state machine + frame being written
+CAPTURE_MAX_FPS: float = 20.0
+
 # Timeouts (seconds)
 WAIT_TIMEOUT_VORTEX: float = 7.0 # idk but it works
 WAIT_TIMEOUT_WEB: float = 4.0 # same
@@ -48,9 +128,69 @@ SCAN_INTERVAL_WEB: float = 0.5
 SCAN_INTERVAL_CLICK_HERE: float = 0.5
 # Delay after final click before restarting scan
 POST_CLICK_DELAY: float = 2.0
+# Adaptive scanning: poll intervals follow how long each state's button usually takes to show up
+ADAPTIVE_SCAN: bool = False
+SCAN_MIN_INTERVAL: float = 0.05 # dense polling inside the expected window
+SCAN_MAX_INTERVAL: float = 2.0 # longest backoff on long idles
+SCAN_SPARSE_FACTOR: float = 3.0 # early polls are this many base intervals apart (never past the window start)
+SCAN_HISTORY: int = 50 # appearance latencies remembered per state
+SCAN_MIN_SAMPLES: int = 5 # fixed intervals until a state has this many samples
+SETTLE_MIN_DELAY: float = 0.3 # lower bound of the learned post-click delay
+# Download watcher (--download-dir): seconds after the last web click for a download to show up,
+# and how often the 'click here' click is retried when none does
+DOWNLOAD_CONFIRM_TIMEOUT: float = 8.0
+DOWNLOAD_RETRIES: int = 1
+PARTIAL_DOWNLOAD_SUFFIXES = (".part", ".crdownload", ".partial", ".download", ".tmp")
+# Nexus tabs a browser window keeps open before they are all closed in one batch, and the browser
+# memory (MB, all its processes) that triggers a batch early; 0 disables the memory budget
+TAB_BUDGET: int = 5
+BROWSER_MEMORY_BUDGET_MB: float = 0.0
+# Window events (--window-events): a new window, a title change (page loaded) or a foreground change of Vortex or
+# a browser wakes the state machine for an immediate scan. For EVENT_BURST seconds after an event or a state change
+# the normal scan intervals apply, otherwise polling slows down to EVENT_POLL_INTERVAL as a safety net
+WINDOW_EVENTS: bool = False
+EVENT_POLL_INTERVAL: float = 1.0
+EVENT_BURST: float = 2.0
+# Flight recorder (--flight-recorder): the last frames (downscaled), detection scores and state transitions stay in
+# memory and are written to a zip in the background when a state times out or the scan crashes
+FLIGHT_RECORDER_FRAMES: int = 40
+FLIGHT_RECORDER_SCALE: float = 0.25
+FLIGHT_RECORDER_MAX_MB: float = 64.0 # frames are dropped oldest first past this, whatever FLIGHT_RECORDER_FRAMES says
+FLIGHT_RECORDER_EVENTS: int = 1000
+# Seconds between metrics file writes (--metrics-file)
+METRICS_INTERVAL: float = 30.0
+# Independent download pipelines (--lanes), each one in its own browser window
+SCAN_LANES: int = 1
+LANE_CLICK_GAP: float = 0.15 # min seconds between two inputs of different lanes, lets the focus change settle
 
 VORTEX_WINDOW_TITLE = "Vortex"
-USER32 = ctypes.windll.user32
+BROWSER_LAUNCH_COMMANDS = {
+    "chrome": r'start chrome --new-window about:blank',
+    "firefox": r'start firefox -new-window about:blank',
+    "edge": r'start msedge --new-window about:blank'
+}
+BROWSER_TITLES = {"chrome": "Google Chrome", "firefox": "Mozilla Firefox", "edge": "Microsoft Edge"}
+BROWSER_CLASS_NAMES = {"chrome": "Chrome_WidgetWin_1", "firefox": "MozillaWindowClass", "edge": "Chrome_WidgetWin_1"}
+USER32 = ctypes.windll.user32 if hasattr(ctypes, "windll") else None
+# Virtual seconds a replayed grab costs, keeps the replay clock moving when nothing sleeps
+REPLAY_GRAB_COST: float = 0.02
+# How clicks are sent (--click-method): one SendInput batch (move, down, up, move back), click messages
+# posted straight to the window under the point (cursor never moves, not every app accepts them), or the
+# old SetCursorPos + mouse_event with a 50 ms sleep after down and after up
+CLICK_METHOD: str = "sendinput"
+CLICK_METHODS = ("sendinput", "post", "legacy")
+CLICK_METHOD_SLEEPS = {"sendinput": 0.0, "post": 0.0, "legacy": 0.1} # charged to the replay clock per click
+# Detector benchmark (--benchmark): the assets are drawn onto synthetic (or --benchmark-backgrounds) screens
+# at known positions with noise, partial occlusion, scale jitter and look-alike decoys
+BENCHMARK_RESOLUTIONS = ((1280, 720), (1920, 1080), (2560, 1440))
+BENCHMARK_FRAMES: int = 30 # per resolution
+BENCHMARK_SEED: int = 1 # same seed, same screens, so runs with different thresholds/matchers are comparable
+BENCHMARK_SCALE_JITTER: float = 0.02 # buttons are drawn at 1 +- this of the asset size (font rendering, not display scaling)
+BENCHMARK_NOISE: float = 2.0 # std of the gaussian pixel noise (lossy remote desktop/video capture)
+BENCHMARK_OCCLUSION: float = 0.15 # max share of a button's width covered on one side
+BENCHMARK_DECOYS: int = 2 # look-alikes per screen: a button with another label and width, they must not be clicked
+BENCHMARK_DECOY_MARGIN: float = 0.05 # a decoy scores at least this much below every button's threshold
+BENCHMARK_DECOY_TRIES: int = 20 # candidates drawn per button image
 
 
 class ScanState(Enum):
@@ -67,16 +207,1666 @@ class ScanState(Enum):
     PROCESS_COMPLETE = auto()
 
 
+class DetectionRule(NamedTuple):
+    button_key: str
+    next_state: ScanState
+    label: str
+    search_window: Optional[str] = None # only search inside this window's rect ("vortex" with --vortex, "browser" with several lanes)
+    on_hit: Optional[str] = None # System method called before the transition
+
+
+class StateSpec(NamedTuple):
+    rules: Tuple[DetectionRule, ...] # in priority order
+    timeout: str # ScanConfig field names, resolved when the plans are compiled
+    scan_interval: str
+    capture_windows: Tuple[str, ...] # the state captures just the bounding box of these windows
+
+
+DIALOG_RULES = (
+    DetectionRule("understood", ScanState.CLICK_UNDERSTOOD, "'Understood' button"), # not sure
+    DetectionRule("staging", ScanState.CLICK_STAGING, "'Staging' button"), # not sure
+)
+
+# The whole scan loop as data: adding a button is an entry in BUTTON_ASSETS plus a rule here
+STATE_GRAPH: Dict[ScanState, StateSpec] = {
+    ScanState.WAIT_FOR_VORTEX_OR_CONTINUE: StateSpec(
+        rules=DIALOG_RULES + (
+            DetectionRule("vortex_cont", ScanState.CLICK_CONTINUE, "Vortex 'Continue' button"),
+            DetectionRule("vortex_dl", ScanState.CLICK_VORTEX, "Vortex 'Download' button", search_window="vortex"),
+        ),
+        timeout="wait_timeout_vortex", scan_interval="scan_interval_vortex", capture_windows=("vortex",)),
+    ScanState.WAIT_FOR_WEB: StateSpec(
+        rules=DIALOG_RULES + (
+            DetectionRule("web_dl", ScanState.CLICK_WEB, "Web Download button", search_window="browser", on_hit="_mark_browser_tab_open"),
+        ),
+        timeout="wait_timeout_web", scan_interval="scan_interval_web", capture_windows=("browser", "vortex")), # understood/staging may still pop up in vortex
+    ScanState.WAIT_FOR_CLICK_HERE: StateSpec(
+        rules=(DetectionRule("click_here", ScanState.CLICK_NEXT, "'Click Here' button", search_window="browser"),),
+        timeout="wait_timeout_click_here", scan_interval="scan_interval_click_here", capture_windows=("browser",)),
+}
+
+# with several lanes only one of them talks to vortex at a time, from picking the vortex button up to
+# clicking the web download (then vortex has moved on to the next mod)
+VORTEX_OWNER_STATES = frozenset({
+    ScanState.WAIT_FOR_VORTEX_OR_CONTINUE, ScanState.CLICK_VORTEX, ScanState.CLICK_CONTINUE,
+    ScanState.CLICK_UNDERSTOOD, ScanState.CLICK_STAGING, ScanState.WAIT_FOR_WEB,
+})
+
+# click state -> (state after the click, log message)
+CLICK_TRANSITIONS: Dict[ScanState, Tuple[ScanState, Optional[str]]] = {
+    ScanState.CLICK_VORTEX: (ScanState.WAIT_FOR_WEB, None),
+    ScanState.CLICK_CONTINUE: (ScanState.WAIT_FOR_WEB, None),
+    ScanState.CLICK_WEB: (ScanState.WAIT_FOR_CLICK_HERE, None),
+    ScanState.CLICK_NEXT: (ScanState.PROCESS_COMPLETE, None),
+    ScanState.CLICK_UNDERSTOOD: (ScanState.WAIT_FOR_VORTEX_OR_CONTINUE, "Clicked 'Understood', re-checking for primary buttons..."), #yep, still not sure, never seen that
+    ScanState.CLICK_STAGING: (ScanState.WAIT_FOR_VORTEX_OR_CONTINUE, "Clicked 'Staging', re-checking for primary buttons..."), #same
+}
+
+
+@dataclass
+class ScanConfig:
+    match_thresholds: Dict[str, float] = field(default_factory=lambda: {
+        "vortex_dl": VORTEX_DL_MATCH_THRESHOLD,
+        "web_dl": WEB_DL_MATCH_THRESHOLD,
+        "click_here": CLICK_HERE_MATCH_THRESHOLD,
+        "vortex_cont": VORTEX_CONT_MATCH_THRESHOLD,
+        "understood": UNDERSTOOD_MATCH_THRESHOLD,
+        "staging": STAGING_MATCH_THRESHOLD,
+    })
+    wait_timeout_vortex: float = WAIT_TIMEOUT_VORTEX
+    wait_timeout_web: float = WAIT_TIMEOUT_WEB
+    wait_timeout_click_here: float = WAIT_TIMEOUT_CLICK_HERE
+    scan_interval_vortex: float = SCAN_INTERVAL_VORTEX
+    scan_interval_web: float = SCAN_INTERVAL_WEB
+    scan_interval_click_here: float = SCAN_INTERVAL_CLICK_HERE
+    post_click_delay: float = POST_CLICK_DELAY
+    matcher_modes: Dict[str, str] = field(default_factory=lambda: dict(MATCHER_MODES))
+    gray_prefilter_threshold: float = GRAY_PREFILTER_THRESHOLD
+    detection_workers: int = DETECTION_WORKERS
+    match_processes: int = MATCH_PROCESSES
+    hit_cache_size: int = HIT_CACHE_SIZE
+    click_cooldown: float = CLICK_COOLDOWN
+    window_scoped_capture: bool = WINDOW_SCOPED_CAPTURE
+    change_threshold: float = CHANGE_THRESHOLD
+    capture_thread: bool = CAPTURE_THREAD
+    adaptive_scan: bool = ADAPTIVE_SCAN
+    metrics_interval: float = METRICS_INTERVAL
+    download_timeout: float = DOWNLOAD_CONFIRM_TIMEOUT
+    download_retries: int = DOWNLOAD_RETRIES
+    tab_budget: int = TAB_BUDGET
+    browser_memory_budget_mb: float = BROWSER_MEMORY_BUDGET_MB
+    scale_calibration: bool = SCALE_CALIBRATION
+    click_method: str = CLICK_METHOD
+
+
+class DetectionPlan(NamedTuple):
+    rules: Tuple[DetectionRule, ...]
+    rules_by_key: Dict[str, DetectionRule]
+    timeout: float
+    scan_interval: float
+    capture_windows: Tuple[str, ...]
+    frame_forms: Tuple[str, ...] # per-frame preprocessing the state's matchers share
+
+
+def compile_state_plans(graph: Dict[ScanState, StateSpec], config: ScanConfig, matcher_modes: Dict[str, str],
+                        use_vortex_logic: bool, lane_scoped: bool = False) -> Dict[ScanState, DetectionPlan]:
+    plans = {}
+    scoped_windows = {"vortex": use_vortex_logic, "browser": lane_scoped}
+    for state, spec in graph.items():
+        rules = tuple(rule if scoped_windows.get(rule.search_window, True) else rule._replace(search_window=None) for rule in spec.rules)
+        forms = []
+        for rule in rules:
+            mode = matcher_modes.get(rule.button_key, "full")
+            form = f"pyr{PYRAMID_FACTOR}" if mode == "pyramid" else "gray" if mode == "gray" else None
+            if form and form not in forms: forms.append(form)
+        plans[state] = DetectionPlan(
+            rules=rules,
+            rules_by_key={rule.button_key: rule for rule in reversed(rules)}, # first rule of a key wins
+            timeout=getattr(config, spec.timeout),
+            scan_interval=getattr(config, spec.scan_interval),
+            capture_windows=tuple(name for name in spec.capture_windows if name != "vortex" or use_vortex_logic),
+            frame_forms=tuple(forms),
+        )
+    return plans
+
+
+class ScanScheduler:
+    def __init__(self, post_click_delay: float):
+        self.latencies: Dict[ScanState, deque] = {}
+        self.idle_streak: Dict[ScanState, int] = {}
+        self.max_settle_delay = post_click_delay
+        self.settle_delay = post_click_delay
+
+    def record_hit(self, state: ScanState, latency: float) -> None:
+        self.latencies.setdefault(state, deque(maxlen=SCAN_HISTORY)).append(latency)
+        self.idle_streak[state] = 0
+
+    def record_timeout(self, state: ScanState) -> None:
+        self.idle_streak[state] = self.idle_streak.get(state, 0) + 1
+
+    def expected_window(self, state: ScanState) -> Optional[Tuple[float, float]]:
+        history = sorted(self.latencies.get(state, ()))
+        if len(history) < SCAN_MIN_SAMPLES: return None
+        return history[int(0.1 * (len(history) - 1))], history[int(0.9 * (len(history) - 1))]
+
+    def next_delay(self, state: ScanState, elapsed: float, base_interval: float) -> float:
+        # sparse before the usual appearance time, dense inside it, growing backoff after it and on idle streaks
+        idle_factor = 2 ** min(self.idle_streak.get(state, 0), 4)
+        window = self.expected_window(state)
+        if window is None:
+            delay = base_interval
+        elif elapsed < window[0]:
+            delay = max(SCAN_MIN_INTERVAL, min(base_interval * SCAN_SPARSE_FACTOR, window[0] - elapsed))
+        elif elapsed <= window[1]:
+            delay = SCAN_MIN_INTERVAL
+        else:
+            delay = base_interval * (1 + (elapsed - window[1]) / max(window[1], base_interval))
+        return min(SCAN_MAX_INTERVAL, delay * idle_factor)
+
+    def settle_feedback(self, latency: Optional[float]) -> None:
+        # latency of the first wait state after the post-click delay, None on timeout:
+        # a button that was already there means we waited too long, a timeout means too short
+        if latency is None:
+            self.settle_delay = min(self.max_settle_delay, self.settle_delay + 0.5)
+        elif latency <= SCAN_MIN_INTERVAL * 2:
+            self.settle_delay = max(SETTLE_MIN_DELAY, self.settle_delay * 0.85)
+
+    def summary(self) -> dict:
+        result = {"settle_delay": round(self.settle_delay, 3)}
+        for state, history in self.latencies.items():
+            ordered = sorted(history)
+            result[f"{state.name}_latency_median"] = round(ordered[len(ordered) // 2], 3)
+        return result
+
+
+class ReplayExhausted(Exception):
+    pass
+
+
+class Clock:
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def perf_counter(self) -> float: # for short latencies, monotonic() can tick in 15 ms steps on windows
+        return time.perf_counter()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0: time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    # replay time only moves when the state machine sleeps or grabs, so runs are deterministic
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0: self.now += seconds
+
+
+class CaptureBackend(ABC):
+    # grab returns a BGRA frame of the requested area (mss dict: left, top, width, height)
+    @abstractmethod
+    def grab(self, area: dict) -> np.ndarray:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class InputBackend(ABC):
+    @abstractmethod
+    def click(self, x: int, y: int) -> None:
+        ...
+
+    @abstractmethod
+    def close_tab(self, hwnd: int, count: int = 1) -> None:
+        ...
+
+
+class WindowBackend(ABC):
+    @abstractmethod
+    def get_monitors(self) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def find_window(self, title: Optional[str] = None, class_name: Optional[str] = None) -> int:
+        ...
+
+    @abstractmethod
+    def find_windows(self, title: Optional[str] = None, class_name: Optional[str] = None) -> List[int]:
+        ...
+
+    @abstractmethod
+    def get_window_rect(self, hwnd: int) -> Optional[Tuple[int, int, int, int]]:
+        ...
+
+    @abstractmethod
+    def get_window_title(self, hwnd: int) -> str:
+        ...
+
+    @abstractmethod
+    def move_window(self, hwnd: int, x: int, y: int, width: Optional[int] = None, height: Optional[int] = None) -> None:
+        ...
+
+    @abstractmethod
+    def focus_window(self, hwnd: int) -> None:
+        ...
+
+    def process_memory(self, hwnd: int) -> Optional[int]:
+        return None # bytes used by the window's process and its children, None if unknown
+
+    @abstractmethod
+    def launch(self, command: str) -> None:
+        ...
+
+
+class MssCaptureBackend(CaptureBackend):
+    def __init__(self):
+        self.screen_capturer = mss.mss()
+
+    def grab(self, area: dict) -> np.ndarray:
+        return np.asarray(self.screen_capturer.grab(area))
+
+    def close(self) -> None:
+        self.screen_capturer.close()
+
+
+class Win32InputBackend(InputBackend):
+    def click(self, x: int, y: int) -> None:
+        original_pos = win32api.GetCursorPos()
+        win32api.SetCursorPos((x, y))
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, x, y, 0, 0)
+        time.sleep(0.05)
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, x, y, 0, 0)
+        time.sleep(0.05)
+        win32api.SetCursorPos(original_pos)
+
+    def close_tab(self, hwnd: int, count: int = 1) -> None:
+        win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+        win32api.keybd_event(win32con.VK_MENU,             0, 0, 0)
+        time.sleep(0.2)
+        win32gui.SetForegroundWindow(hwnd)
+        win32api.keybd_event(win32con.VK_MENU,             0, win32con.KEYEVENTF_KEYUP, 0)
+
+        time.sleep(0.05)
+        win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
+        for _ in range(count): # one focus for the whole batch
+            win32api.keybd_event(ord('W'),             0, 0, 0)
+            time.sleep(0.05)
+            win32api.keybd_event(ord('W'),             0, win32con.KEYEVENTF_KEYUP, 0)
+            time.sleep(0.05)
+        win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
+
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [("dx", ctypes.c_long), ("dy", ctypes.c_long), ("mouseData", ctypes.c_ulong),
+                ("dwFlags", ctypes.c_ulong), ("time", ctypes.c_ulong), ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class _INPUT(ctypes.Structure):
+    # the union's other members (keyboard, hardware) are smaller than MOUSEINPUT, so it can stand alone
+    _fields_ = [("type", ctypes.c_ulong), ("mi", _MOUSEINPUT)]
+
+
+class SendInputBackend(Win32InputBackend):
+    MOVE, LEFTDOWN, LEFTUP, VIRTUALDESK, ABSOLUTE = 0x0001, 0x0002, 0x0004, 0x4000, 0x8000
+
+    @staticmethod
+    def click_events(x: int, y: int, cursor: Tuple[int, int], desktop: Tuple[int, int, int, int]) -> List[Tuple[int, int, int]]:
+        # (dx, dy, flags) in the 0..65535 absolute coordinates of the virtual desktop
+        left, top, width, height = desktop
+        def absolute(px, py):
+            return (px - left) * 65535 // max(1, width - 1), (py - top) * 65535 // max(1, height - 1)
+        move = SendInputBackend.MOVE | SendInputBackend.ABSOLUTE | SendInputBackend.VIRTUALDESK
+        target, back = absolute(x, y), absolute(*cursor)
+        return [(*target, move), (*target, move | SendInputBackend.LEFTDOWN), (*target, move | SendInputBackend.LEFTUP), (*back, move)]
+
+    def click(self, x: int, y: int) -> None:
+        # one atomic batch without sleeps, the cursor is only away from the user for the batch itself
+        desktop = tuple(USER32.GetSystemMetrics(i) for i in (76, 77, 78, 79)) # SM_X/YVIRTUALSCREEN, SM_CX/CYVIRTUALSCREEN
+        events = self.click_events(x, y, win32api.GetCursorPos(), desktop)
+        inputs = (_INPUT * len(events))(*[_INPUT(0, _MOUSEINPUT(dx, dy, 0, flags, 0, 0)) for dx, dy, flags in events]) # type 0 = mouse
+        if USER32.SendInput(len(events), inputs, ctypes.sizeof(_INPUT)) != len(events):
+            raise OSError(f"SendInput was blocked (error {ctypes.GetLastError()})")
+
+
+class PostMessageInputBackend(Win32InputBackend):
+    def click(self, x: int, y: int) -> None:
+        hwnd = win32gui.WindowFromPoint((x, y))
+        if not hwnd: raise OSError(f"No window at ({x}, {y})")
+        client_x, client_y = win32gui.ScreenToClient(hwnd, (x, y))
+        position = win32api.MAKELONG(client_x & 0xFFFF, client_y & 0xFFFF)
+        win32gui.PostMessage(hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, position)
+        win32gui.PostMessage(hwnd, win32con.WM_LBUTTONUP, 0, position)
+
+
+INPUT_BACKENDS = {"sendinput": SendInputBackend, "post": PostMessageInputBackend, "legacy": Win32InputBackend}
+
+
+class Win32WindowBackend(WindowBackend):
+    def get_monitors(self) -> List[dict]:
+        monitors_raw = win32api.EnumDisplayMonitors(None, None)
+        monitor_details = []
+        primary_monitor_found = False
+        if not monitors_raw:
+             return []
+
+        for i, monitor in enumerate(monitors_raw):
+            try:
+                monitor_info = win32api.GetMonitorInfo(monitor[0].handle)
+                rect = monitor[2]
+                is_primary = monitor_info.get("Flags") == win32con.MONITORINFOF_PRIMARY
+                details = {
+                    "handle": monitor[0].handle,
+                    "device": monitor_info.get("Device", f"Unknown_{i}"),
+                    "left": rect[0],
+                    "top": rect[1],
+                    "width": rect[2] - rect[0],
+                    "height": rect[3] - rect[1],
+                    "is_primary": is_primary
+                }
+                monitor_details.append(details)
+                if is_primary:
+                    primary_monitor_found = True
+            except Exception as e:
+                 logging.error(f"Could not get info for monitor {i}: {e}")
+
+        if not primary_monitor_found and monitor_details:
+             monitor_details[0]['is_primary'] = True # Fallback
+        return monitor_details
+
+    def find_window(self, title: Optional[str] = None, class_name: Optional[str] = None) -> int:
+        return USER32.FindWindowW(class_name, title)
+
+    def find_windows(self, title: Optional[str] = None, class_name: Optional[str] = None) -> List[int]:
+        handles = []
+        def collect(hwnd, _):
+            if not win32gui.IsWindowVisible(hwnd): return True
+            if title is not None and win32gui.GetWindowText(hwnd) != title: return True
+            if class_name is not None and win32gui.GetClassName(hwnd) != class_name: return True
+            handles.append(hwnd)
+            return True
+        win32gui.EnumWindows(collect, None) # top to bottom z-order
+        return handles
+
+    def get_window_rect(self, hwnd: int) -> Optional[Tuple[int, int, int, int]]:
+        return win32gui.GetWindowRect(hwnd)
+
+    def get_window_title(self, hwnd: int) -> str:
+        return win32gui.GetWindowText(hwnd)
+
+    def move_window(self, hwnd: int, x: int, y: int, width: Optional[int] = None, height: Optional[int] = None) -> None:
+        if width and height:
+            win32gui.ShowWindow(hwnd, win32con.SW_RESTORE) # maximized windows ignore the new size
+            win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, x, y, width, height, win32con.SWP_SHOWWINDOW)
+        else:
+            win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, x, y, 0, 0, win32con.SWP_NOSIZE | win32con.SWP_SHOWWINDOW)
+
+    def focus_window(self, hwnd: int) -> None:
+        win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+        win32api.keybd_event(win32con.VK_MENU, 0, 0, 0) # windows only hands focus over while alt is down
+        win32gui.SetForegroundWindow(hwnd)
+        win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
+        time.sleep(0.05)
+
+    def process_memory(self, hwnd: int) -> Optional[int]:
+        if psutil is None: return None
+        _, pid = win32process.GetWindowThreadProcessId(hwnd)
+        process = psutil.Process(pid)
+        # browsers keep tabs in child processes, the window belongs to the parent
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def launch(self, command: str) -> None:
+        subprocess.Popen(command, shell=True); time.sleep(1.5)
+
+
+class WindowEvent(NamedTuple):
+    t: float # clock time
+    kind: str # "create", "show", "title" or "foreground"
+    hwnd: int
+    title: str
+
+
+class WindowEventSource(ABC):
+    @abstractmethod
+    def wait(self, timeout: float) -> List[WindowEvent]:
+        # events that arrived since the last call, waits up to timeout for the first one
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class WinEventSource(WindowEventSource):
+    # SetWinEventHook, out of context: the callbacks run on our own thread, which has to pump messages for them
+    EVENTS = {0x0003: "foreground", 0x8000: "create", 0x8002: "show", 0x800C: "title"}
+    HOOK_RANGES = ((0x0003, 0x0003), (0x8000, 0x8002), (0x800C, 0x800C)) # skips location changes, the cursor fires those nonstop
+
+    def __init__(self):
+        self.events: deque = deque()
+        self.cond = threading.Condition()
+        self.thread_id = 0
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="window-events", daemon=True)
+        self.thread.start()
+        self.ready.wait(2.0)
+
+    def _run(self) -> None:
+        import ctypes.wintypes
+        proc_type = ctypes.WINFUNCTYPE(None, ctypes.wintypes.HANDLE, ctypes.wintypes.DWORD, ctypes.wintypes.HWND,
+                                       ctypes.wintypes.LONG, ctypes.wintypes.LONG, ctypes.wintypes.DWORD, ctypes.wintypes.DWORD)
+        title = ctypes.create_unicode_buffer(256)
+
+        def callback(hook, event, hwnd, id_object, id_child, thread, event_time):
+            # whole top level windows only (OBJID_WINDOW, no child id), not the controls inside them
+            if id_object != 0 or id_child != 0 or not hwnd or USER32.GetAncestor(hwnd, 2) != hwnd: return # GA_ROOT
+            USER32.InternalGetWindowText(hwnd, title, len(title)) # doesn't send a message to a maybe hung window
+            with self.cond:
+                self.events.append(WindowEvent(time.monotonic(), self.EVENTS.get(event, "?"), hwnd, title.value))
+                self.cond.notify_all()
+
+        proc = proc_type(callback) # referenced until the loop ends, or the hook calls into freed memory
+        hooks = [USER32.SetWinEventHook(low, high, 0, proc, 0, 0, 0x0002) for low, high in self.HOOK_RANGES] # WINEVENT_SKIPOWNPROCESS
+        self.thread_id = ctypes.windll.kernel32.GetCurrentThreadId()
+        self.ready.set()
+        msg = ctypes.wintypes.MSG()
+        while USER32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            USER32.TranslateMessage(ctypes.byref(msg))
+            USER32.DispatchMessageW(ctypes.byref(msg))
+        for hook in hooks:
+            if hook: USER32.UnhookWinEvent(hook)
+
+    def wait(self, timeout: float) -> List[WindowEvent]:
+        with self.cond:
+            if not self.events and timeout > 0: self.cond.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def close(self) -> None:
+        if self.thread_id: USER32.PostThreadMessageW(self.thread_id, 0x0012, 0, 0) # WM_QUIT
+        self.thread.join(timeout=2.0)
+
+
+# Replay backends: a session directory holds session.json (monitors, window rects, frame list)
+# and the frames as png files, as written by RecordingCaptureBackend.
+SESSION_FILE = "session.json"
+
+
+class RecordingCaptureBackend(CaptureBackend):
+    def __init__(self, inner: CaptureBackend, session_dir: str, clock: Clock):
+        self.inner = inner
+        self.session_dir = session_dir
+        self.clock = clock
+        self.start_time = clock.monotonic()
+        self.frames: List[dict] = []
+        self.metadata: dict = {}
+        os.makedirs(session_dir, exist_ok=True)
+
+    def grab(self, area: dict) -> np.ndarray:
+        img = self.inner.grab(area)
+        filename = f"frame_{len(self.frames):06d}.png"
+        cv2.imwrite(os.path.join(self.session_dir, filename), img[:, :, :3], [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        self.frames.append({
+            "file": filename,
+            "t": round(self.clock.monotonic() - self.start_time, 4),
+            "area": {k: area[k] for k in ("left", "top", "width", "height")},
+        })
+        return img
+
+    def close(self) -> None:
+        session = dict(self.metadata, frames=self.frames)
+        with open(os.path.join(self.session_dir, SESSION_FILE), "w") as f:
+            json.dump(session, f, indent=1)
+        logging.info(f"Recorded {len(self.frames)} frames to {self.session_dir}")
+        self.inner.close()
+
+
+class ReplayCaptureBackend(CaptureBackend):
+    def __init__(self, session_dir: str, clock: Clock, grab_cost: float = REPLAY_GRAB_COST):
+        self.session_dir = session_dir
+        self.clock = clock
+        self.grab_cost = grab_cost
+        with open(os.path.join(session_dir, SESSION_FILE)) as f:
+            self.session = json.load(f)
+        self.frames: List[dict] = self.session.get("frames", [])
+        if not self.frames:
+            raise RuntimeError(f"Replay session {session_dir} has no frames.")
+        self.start_time = clock.monotonic()
+        self.frames_served = 0
+        self._frame_index = -1
+        self._frame_img: Optional[np.ndarray] = None
+
+    def _current_frame(self) -> Tuple[dict, np.ndarray]:
+        elapsed = self.clock.monotonic() - self.start_time
+        if elapsed > self.frames[-1]["t"] + self.grab_cost:
+            raise ReplayExhausted(f"Replay session ended after {self.frames_served} frames.")
+        index = max(self._frame_index, 0)
+        while index + 1 < len(self.frames) and self.frames[index + 1]["t"] <= elapsed:
+            index += 1
+        if index != self._frame_index or self._frame_img is None:
+            path = os.path.join(self.session_dir, self.frames[index]["file"])
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None: raise IOError(f"Could not load replay frame: {path}")
+            self._frame_img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+            self._frame_index = index
+        return self.frames[index], self._frame_img
+
+    def grab(self, area: dict) -> np.ndarray:
+        self.clock.sleep(self.grab_cost)
+        meta, frame = self._current_frame()
+        self.frames_served += 1
+        # crop the requested area out of the recorded one, anything outside it is black
+        out = np.zeros((area["height"], area["width"], 4), dtype=np.uint8)
+        rec = meta["area"]
+        x1, y1 = max(area["left"], rec["left"]), max(area["top"], rec["top"])
+        x2 = min(area["left"] + area["width"], rec["left"] + rec["width"])
+        y2 = min(area["top"] + area["height"], rec["top"] + rec["height"])
+        if x1 < x2 and y1 < y2:
+            out[y1 - area["top"]:y2 - area["top"], x1 - area["left"]:x2 - area["left"]] = \
+                frame[y1 - rec["top"]:y2 - rec["top"], x1 - rec["left"]:x2 - rec["left"]]
+        return out
+
+
+class RecordingInputBackend(InputBackend):
+    # headless stand-in: records what would have been sent, and spends the sleeps of the chosen click
+    # method on the clock so replay cycle times show what a click method costs
+    def __init__(self, clock: Clock, click_sleep: float = 0.0):
+        self.clock = clock
+        self.click_sleep = click_sleep
+        self.events: List[dict] = []
+
+    def click(self, x: int, y: int) -> None:
+        self.events.append({"t": round(self.clock.monotonic(), 4), "action": "click", "x": x, "y": y})
+        if self.click_sleep: self.clock.sleep(self.click_sleep)
+
+    def close_tab(self, hwnd: int, count: int = 1) -> None:
+        self.events.append({"t": round(self.clock.monotonic(), 4), "action": "close_tab", "hwnd": hwnd, "count": count})
+
+
+class ReplayWindowBackend(WindowBackend):
+    # window rects come from the session file, handles are just 1-based indices into it
+    def __init__(self, session: dict):
+        self.monitors = session.get("monitors", [])
+        self.windows: List[Tuple[str, Optional[str], Tuple[int, int, int, int]]] = [
+            (w.get("title"), w.get("class_name"), tuple(w["rect"])) for w in session.get("windows", [])
+        ]
+
+    def get_monitors(self) -> List[dict]:
+        return [dict(m) for m in self.monitors]
+
+    def find_window(self, title: Optional[str] = None, class_name: Optional[str] = None) -> int:
+        for i, (w_title, w_class, _) in enumerate(self.windows):
+            if (title is None or title == w_title) and (class_name is None or class_name == w_class):
+                return i + 1
+        return 0
+
+    def find_windows(self, title: Optional[str] = None, class_name: Optional[str] = None) -> List[int]:
+        return [i + 1 for i, (w_title, w_class, _) in enumerate(self.windows)
+                if (title is None or title == w_title) and (class_name is None or class_name == w_class)]
+
+    def get_window_rect(self, hwnd: int) -> Optional[Tuple[int, int, int, int]]:
+        if 0 < hwnd <= len(self.windows): return self.windows[hwnd - 1][2]
+        return None
+
+    def get_window_title(self, hwnd: int) -> str:
+        return self.windows[hwnd - 1][0] if 0 < hwnd <= len(self.windows) else ""
+
+    def move_window(self, hwnd: int, x: int, y: int, width: Optional[int] = None, height: Optional[int] = None) -> None:
+        pass
+
+    def focus_window(self, hwnd: int) -> None:
+        pass
+
+    def launch(self, command: str) -> None:
+        pass
+
+
+class RecordingWindowEventSource(WindowEventSource):
+    # passes events through and keeps them (time relative to the recording) for the session file
+    def __init__(self, inner: WindowEventSource, clock: Clock, start_time: float):
+        self.inner = inner
+        self.clock = clock
+        self.start_time = start_time
+        self.recorded: List[dict] = []
+
+    def wait(self, timeout: float) -> List[WindowEvent]:
+        events = self.inner.wait(timeout)
+        for event in events:
+            self.recorded.append({"t": round(event.t - self.start_time, 4), "kind": event.kind, "title": event.title})
+        return events
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class ScriptedWindowEventSource(WindowEventSource):
+    # headless stand-in: events at fixed clock times, from a recorded session or pushed by a test
+    def __init__(self, clock: Clock, events: Optional[List[dict]] = None, start_time: float = 0.0):
+        self.clock = clock
+        self.start_time = start_time
+        self.pending: deque = deque()
+        for event in sorted(events or [], key=lambda e: e["t"]):
+            self.push(event["kind"], event.get("title", ""), event["t"], event.get("hwnd", 0))
+
+    def push(self, kind: str, title: str = "", at: Optional[float] = None, hwnd: int = 0) -> None:
+        # at is relative to start_time, default now
+        t = self.start_time + at if at is not None else self.clock.monotonic()
+        self.pending.append(WindowEvent(t, kind, hwnd, title))
+
+    def wait(self, timeout: float) -> List[WindowEvent]:
+        now = self.clock.monotonic()
+        if not self.pending or self.pending[0].t > now + timeout:
+            self.clock.sleep(timeout)
+            return []
+        if self.pending[0].t > now: self.clock.sleep(self.pending[0].t - now)
+        now = self.clock.monotonic()
+        events = []
+        while self.pending and self.pending[0].t <= now:
+            events.append(self.pending.popleft())
+        return events
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    # benchmark screens: a background with the button templates drawn at known spots, grab() returns the current one
+    def __init__(self, templates: Dict[str, List[np.ndarray]], backgrounds: List[np.ndarray], seed: int = BENCHMARK_SEED):
+        self.backgrounds = backgrounds
+        self.rng = np.random.default_rng(seed)
+        self.frame: Optional[np.ndarray] = None
+        self.templates: Dict[str, List[np.ndarray]] = {}
+        self.decoys: List[np.ndarray] = []
+        if templates: self.set_templates(templates, {})
+
+    def set_templates(self, templates: Dict[str, List[np.ndarray]], thresholds: Dict[str, float]) -> None:
+        self.templates = templates
+        self.decoys = []
+        for key, variants in templates.items():
+            for variant in variants:
+                decoy = next((d for d in (self._decoy(variant) for _ in range(BENCHMARK_DECOY_TRIES))
+                              if self._decoy_score(d, thresholds) < -BENCHMARK_DECOY_MARGIN), None)
+                if decoy is None:
+                    logging.warning(f"Benchmark: no decoy of '{key}' scores clearly below the thresholds, leaving it out.")
+                    continue
+                assert self._decoy_score(decoy, thresholds) < -BENCHMARK_DECOY_MARGIN
+                self.decoys.append(decoy)
+
+    def _decoy(self, button: np.ndarray) -> np.ndarray:
+        # same frame and colours, another label, and (mostly) another width: a different button of the same app
+        rng = self.rng
+        decoy = button.copy()
+        h, w = decoy.shape[:2]
+        inner = decoy[max(1, h // 5):h - max(1, h // 5), max(1, w // 10):w - max(1, w // 10)]
+        fill = np.median(inner.reshape(-1, 3), axis=0)
+        text_pixels = np.abs(inner.astype(np.int16) - fill).sum(axis=2) > 60
+        ink = inner[text_pixels].mean(axis=0) if text_pixels.any() else 255 - fill
+        inner[:] = fill.astype(np.uint8)
+        label = "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), int(rng.integers(3, 9)))).capitalize()
+        font_scale = inner.shape[0] / 30
+        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+        cv2.putText(inner, label, (max(0, (inner.shape[1] - text_w) // 2), (inner.shape[0] + text_h) // 2),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, [int(c) for c in ink], 1, cv2.LINE_AA)
+        if rng.random() < 0.8:
+            width = max(1, round(w * float(rng.choice([rng.uniform(0.6, 0.8), rng.uniform(1.25, 1.5)]))))
+            decoy = cv2.resize(decoy, (width, h), interpolation=cv2.INTER_LINEAR)
+        return decoy
+
+    def _decoy_score(self, decoy: np.ndarray, thresholds: Dict[str, float]) -> float:
+        # highest score of any button image on the decoy, relative to that button's threshold (must stay negative)
+        pad = max(max(v.shape[:2]) for variants in self.templates.values() for v in variants)
+        canvas = cv2.copyMakeBorder(decoy, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+        return max(cv2.minMaxLoc(cv2.matchTemplate(canvas, variant, cv2.TM_CCOEFF_NORMED))[1] - thresholds.get(key, DEFAULT_MATCH_THRESHOLD)
+                   for key, variants in self.templates.items() for variant in variants)
+
+    def _background(self, width: int, height: int) -> np.ndarray:
+        rng = self.rng
+        if self.backgrounds:
+            # a random crop of a recorded screen, scaled up first if it's smaller than the target
+            img = self.backgrounds[rng.integers(len(self.backgrounds))]
+            factor = max(width / img.shape[1], height / img.shape[0], 1.0)
+            if factor > 1.0:
+                img = cv2.resize(img, (int(img.shape[1] * factor) + 1, int(img.shape[0] * factor) + 1))
+            x, y = rng.integers(img.shape[1] - width + 1), rng.integers(img.shape[0] - height + 1)
+            return img[y:y + height, x:x + width].copy()
+        # a desktop-ish screen: gradient wallpaper, a few window panels with text lines in them
+        top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+        ramp = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+        img = np.ascontiguousarray(np.broadcast_to(top * (1 - ramp) + bottom * ramp, (height, width, 3)).astype(np.uint8))
+        for _ in range(rng.integers(3, 9)):
+            x1, y1 = int(rng.integers(0, width - 100)), int(rng.integers(0, height - 100))
+            x2, y2 = int(rng.integers(x1 + 100, width + 1)), int(rng.integers(y1 + 100, height + 1))
+            color = [int(c) for c in rng.integers(0, 256, 3)]
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, -1)
+            cv2.rectangle(img, (x1, y1), (x2, y2), [255 - c for c in color], 1)
+            ink = (0, 0, 0) if sum(color) > 384 else (255, 255, 255)
+            for line_y in range(y1 + 20, y2 - 5, int(rng.integers(18, 40))):
+                text = "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz  ABCDEFGH0123456789"), int(rng.integers(5, 40))))
+                cv2.putText(img, text, (x1 + 8, line_y), cv2.FONT_HERSHEY_SIMPLEX, float(rng.uniform(0.35, 0.7)), ink, 1, cv2.LINE_AA)
+        return img
+
+    def _place(self, occupied: List[Tuple[int, int, int, int]], width: int, height: int, w: int, h: int) -> Optional[Tuple[int, int]]:
+        for _ in range(30):
+            x, y = int(self.rng.integers(0, width - w + 1)), int(self.rng.integers(0, height - h + 1))
+            if all(x + w <= ox1 or ox2 <= x or y + h <= oy1 or oy2 <= y for ox1, oy1, ox2, oy2 in occupied):
+                occupied.append((x, y, x + w, y + h))
+                return x, y
+        return None
+
+    def next_frame(self, width: int, height: int) -> List[Tuple[str, Tuple[int, int], Tuple[int, int]]]:
+        # draws the next screen, returns (button key, centre, drawn size) of every real button on it
+        rng = self.rng
+        img = self._background(width, height)
+        occupied: List[Tuple[int, int, int, int]] = []
+        truths = []
+        keys = list(self.templates)
+        for key in rng.choice(keys, int(rng.integers(0, min(3, len(keys)) + 1)), replace=False):
+            variants = self.templates[key]
+            button = variants[rng.integers(len(variants))]
+            scale = 1.0 + float(rng.uniform(-BENCHMARK_SCALE_JITTER, BENCHMARK_SCALE_JITTER))
+            size = (max(1, round(button.shape[1] * scale)), max(1, round(button.shape[0] * scale)))
+            button = cv2.resize(button, size, interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+            h, w = button.shape[:2]
+            spot = self._place(occupied, width, height, w, h)
+            if spot is None: continue
+            x, y = spot
+            img[y:y + h, x:x + w] = button
+            if rng.random() < 0.3: # something (a tooltip, another window) covers one side
+                cover = int(w * rng.uniform(0.05, BENCHMARK_OCCLUSION))
+                x1 = x if rng.random() < 0.5 else x + w - cover
+                img[y:y + h, x1:x1 + cover] = [int(c) for c in rng.integers(0, 256, 3)]
+            truths.append((str(key), (x + w // 2, y + h // 2), (w, h)))
+        for _ in range(BENCHMARK_DECOYS if self.decoys else 0):
+            decoy = self.decoys[rng.integers(len(self.decoys))]
+            h, w = decoy.shape[:2]
+            spot = self._place(occupied, width, height, w, h)
+            if spot: img[spot[1]:spot[1] + h, spot[0]:spot[0] + w] = decoy
+        if BENCHMARK_NOISE > 0:
+            noise = rng.standard_normal(img.shape, dtype=np.float32) * BENCHMARK_NOISE
+            img = np.clip(img + noise, 0, 255).astype(np.uint8)
+        self.frame = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+        return truths
+
+    def grab(self, area: dict) -> np.ndarray:
+        return self.frame[area["top"]:area["top"] + area["height"], area["left"]:area["left"] + area["width"]]
+
+
+class ButtonTemplate:
+    # one template variant plus derived forms (downscaled etc.), computed once and reused
+    def __init__(self, image: np.ndarray, filename: str = ""):
+        self.image = image
+        self.filename = filename
+        self.height, self.width = image.shape[:2]
+        self.derived: Dict[str, np.ndarray] = {}
+        self.scaled: Dict[float, ButtonTemplate] = {}
+
+    def at_scale(self, scale: float) -> ButtonTemplate:
+        # the button as drawn at another display scale or zoom level than the one it was captured at
+        if scale == 1.0: return self
+        if scale not in self.scaled:
+            size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            self.scaled[scale] = ButtonTemplate(cv2.resize(self.image, size, interpolation=interpolation), self.filename)
+        return self.scaled[scale]
+
+    def downscaled(self, factor: int) -> np.ndarray:
+        form = f"pyr{factor}"
+        if form not in self.derived:
+            size = (max(1, self.width // factor), max(1, self.height // factor))
+            self.derived[form] = cv2.resize(self.image, size, interpolation=cv2.INTER_AREA)
+        return self.derived[form]
+
+    def gray(self) -> np.ndarray:
+        if "gray" not in self.derived:
+            self.derived["gray"] = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self.derived["gray"]
+
+
+class MatchStats:
+    # call count, total seconds and candidates per matching stage
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, candidates: int = 0) -> None:
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += candidates
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {f"{stage}_{name}": round(value, 4) if name == "seconds" else value
+                    for stage, entry in self.stages.items()
+                    for name, value in zip(("calls", "seconds", "candidates"), entry)}
+
+
+class ScoreHistograms:
+    # cheap enough to always collect: one bin increment per template search
+    def __init__(self, bins: int):
+        self.bins = bins
+        self.counts: Dict[str, List[int]] = {} # "<key>/<asset file>" -> counts per bin
+        self.lock = threading.Lock()
+
+    def add(self, button_key: str, variant: str, score: float, best: Dict[str, float]) -> None:
+        index = min(self.bins - 1, max(0, int(score * self.bins)))
+        with self.lock:
+            self.counts.setdefault(f"{button_key}/{variant}", [0] * self.bins)[index] += 1
+            if score > best.get(button_key, -1.0): best[button_key] = score
+
+    def merge(self, counts: Dict[str, List[int]]) -> None:
+        with self.lock:
+            for name, bins in counts.items():
+                if len(bins) != self.bins: continue
+                own = self.counts.setdefault(name, [0] * self.bins)
+                for i, count in enumerate(bins): own[i] += count
+
+
+def propose_threshold(bins: List[int], current: float) -> Tuple[float, str]:
+    # the top cluster of scores is the button, the next one down the background (or a look-alike), they
+    # have to be at least 2 * TUNE_MARGIN apart
+    size = len(bins)
+    top = max((i for i, count in enumerate(bins) if count), default=None)
+    if top is None: return current, "no scores"
+    gap_bins = int(2 * TUNE_MARGIN * size + 0.999)
+    lowest, empty, hits = top, 0, 0
+    for i in range(top, -1, -1):
+        if bins[i]:
+            if empty >= gap_bins: break
+            lowest, empty, hits = i, 0, hits + bins[i]
+        else:
+            empty += 1
+    else:
+        return current, f"no gap between button and background scores (top scores from {lowest / size:.2f})"
+    button_low, background_high = lowest / size, (i + 1) / size
+    if hits < TUNE_MIN_HITS:
+        return current, f"only {hits} button scores"
+    # a threshold inside the gap stays, else it moves just far enough to be clear of both
+    proposal = round(min(max(current, background_high + TUNE_MARGIN), button_low - TUNE_MARGIN, 0.99), 3)
+    if proposal < max(TUNE_FLOOR, current - TUNE_MAX_LOWER):
+        return current, f"top scores from {button_low:.2f} are too far below the threshold to trust, check the screen by hand"
+    return proposal, f"button scores from {button_low:.2f}, background up to {background_high:.2f}, {hits} button scores"
+
+
+def tune_thresholds(current: Dict[str, float]) -> Dict[str, float]:
+    # offline: reads the collected histograms, logs a proposal per key and writes them to THRESHOLD_FILE
+    path = os.path.join(ASSET_DIRECTORY, SCORE_HISTOGRAM_FILE)
+    with open(path) as f:
+        counts: Dict[str, List[int]] = json.load(f).get("counts", {})
+    proposals = {}
+    for button_key in BUTTON_ASSETS:
+        variants = {name: bins for name, bins in counts.items() if name.split("/")[0] == button_key}
+        if not variants:
+            logging.warning(f"{button_key}: no scores collected, keeping {current.get(button_key, DEFAULT_MATCH_THRESHOLD)}")
+            continue
+        merged = [sum(column) for column in zip(*variants.values())]
+        previous = current.get(button_key, DEFAULT_MATCH_THRESHOLD) # new buttons may not have a threshold of their own
+        threshold, reason = propose_threshold(merged, previous)
+        change = "keeping" if threshold == previous else f"{previous} ->"
+        logging.warning(f"{button_key}: {change} {threshold} ({reason})")
+        for name, bins in variants.items():
+            top = max((i for i, count in enumerate(bins) if count), default=0)
+            logging.warning(f"    {name.split('/', 1)[1]}: {sum(bins)} searches, best {top / len(bins):.2f}-{(top + 1) / len(bins):.2f}")
+        if threshold != previous: proposals[button_key] = threshold
+    path = os.path.join(ASSET_DIRECTORY, THRESHOLD_FILE)
+    thresholds = dict(load_thresholds(), **proposals)
+    with open(path, "w") as f:
+        json.dump(thresholds, f, indent=1)
+    logging.warning(f"Thresholds written to {path}: {thresholds}")
+    return thresholds
+
+
+def load_thresholds() -> Dict[str, float]:
+    path = os.path.join(ASSET_DIRECTORY, THRESHOLD_FILE)
+    if not os.path.isfile(path): return {}
+    try:
+        with open(path) as f:
+            return {key: float(value) for key, value in json.load(f).items() if key in BUTTON_ASSETS}
+    except (OSError, ValueError, AttributeError) as e:
+        logging.warning(f"Ignoring unreadable threshold file {path}: {e}")
+        return {}
+
+
+class HitCache:
+    # per button key: recent hit locations (screen coords) and the template variant that matched there
+    def __init__(self, size: int, radius: int):
+        self.size = size
+        self.radius = radius
+        self.entries: Dict[str, deque] = {}
+        self.window_rects: Dict[str, Optional[Tuple[int, int, int, int]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def entries_for(self, button_key: str) -> List[Tuple[Tuple[int, int], int]]:
+        if self.size <= 0: return []
+        with self.lock:
+            return list(self.entries.get(button_key, ()))
+
+    def remember(self, button_key: str, location: Tuple[int, int], variant: int) -> None:
+        if self.size <= 0: return
+        with self.lock:
+            entries = self.entries.setdefault(button_key, deque(maxlen=self.size))
+            for entry in list(entries):
+                if abs(entry[0][0] - location[0]) <= self.radius and abs(entry[0][1] - location[1]) <= self.radius:
+                    entries.remove(entry)
+            entries.appendleft((location, variant))
+
+    def count(self, hit: bool) -> None:
+        with self.lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+
+    def invalidate(self, reason: str) -> None:
+        with self.lock:
+            if self.entries:
+                logging.info(f"Hit cache invalidated: {reason}")
+                self.entries.clear()
+                self.invalidations += 1
+
+    def observe_windows(self, window_rects: Dict[str, Optional[Tuple[int, int, int, int]]]) -> None:
+        # cached locations are only valid as long as the windows they were found in stay put
+        for name, rect in window_rects.items():
+            previous = self.window_rects.get(name)
+            if name in self.window_rects and previous != rect:
+                self.invalidate(f"{name} window moved/resized {previous} -> {rect}")
+            self.window_rects[name] = rect
+
+
+class ClickIndex:
+    # recent clicks, oldest first: (button key, screen location, clock time, signature of the screen around it)
+    def __init__(self, cooldown: float, radius: int, threshold: float):
+        self.cooldown = cooldown
+        self.radius = radius
+        self.threshold = threshold
+        self.entries: deque = deque()
+        self.suppressed: Dict[str, int] = {}
+
+    def remember(self, button_key: str, location: Tuple[int, int], t: float, signature: Optional[np.ndarray]) -> None:
+        if self.cooldown > 0 and signature is not None:
+            self.entries.append((button_key, location, t, signature))
+
+    def is_duplicate(self, button_key: str, location: Tuple[int, int], t: float, signature: np.ndarray) -> bool:
+        while self.entries and t - self.entries[0][2] > self.cooldown:
+            self.entries.popleft()
+        for key, (x, y), _, previous in self.entries:
+            if (key == button_key and abs(x - location[0]) <= self.radius and abs(y - location[1]) <= self.radius
+                    and float(np.abs(previous - signature).mean()) < self.threshold):
+                self.suppressed[button_key] = self.suppressed.get(button_key, 0) + 1
+                return True
+        return False
+
+
+class CaptureThread:
+    def __init__(self, backend: CaptureBackend, ring_size: int = CAPTURE_RING_SIZE, max_fps: float = CAPTURE_MAX_FPS):
+        self.backend = backend
+        self.ring_size = max(3, ring_size)
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.ring: List[Optional[np.ndarray]] = [None] * self.ring_size
+        self.area: Optional[dict] = None
+        self.latest: Optional[Tuple[int, int, dict, float]] = None # (seq, slot, area, grab started)
+        self.held_slot: Optional[int] = None
+        self.wanted = False # a grab was asked for; one frame ahead of the consumer, never more
+        self.not_before = 0.0 # frames grabbed earlier are stale: the state machine slept or clicked since
+        self.seq = 0
+        self.frames_grabbed = 0
+        self.error: Optional[BaseException] = None
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.stopped and (self.area is None or not self.wanted):
+                    self.cond.wait()
+                if self.stopped: return
+                self.wanted = False
+                area = self.area
+                latest_slot = self.latest[1] if self.latest else None
+                slot = next(i for i in range(self.ring_size) if i not in (latest_slot, self.held_slot))
+            started = time.perf_counter()
+            grabbed_at = time.monotonic()
+            try:
+                sct_img = self.backend.grab(area)
+            except BaseException as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+            # convert in place into the slot's buffer, buffers are only reallocated when the area size changes
+            buffer = self.ring[slot]
+            if buffer is None or buffer.shape[:2] != sct_img.shape[:2]:
+                buffer = self.ring[slot] = np.empty((sct_img.shape[0], sct_img.shape[1], 3), dtype=np.uint8)
+            cv2.cvtColor(sct_img, cv2.COLOR_BGRA2BGR, dst=buffer)
+            with self.cond:
+                self.seq += 1
+                self.frames_grabbed += 1
+                self.latest = (self.seq, slot, area, grabbed_at)
+                self.cond.notify_all()
+            remaining = self.min_interval - (time.perf_counter() - started)
+            if remaining > 0: time.sleep(remaining)
+
+    def next_frame(self, after_seq: int, area: dict, timeout: float = 1.0) -> Optional[Tuple[int, np.ndarray]]:
+        # newest frame of the area newer than after_seq; the returned buffer stays valid until the next call
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if self.area != area:
+                self.area = area
+                self.cond.notify_all()
+            self.held_slot = None
+            while True:
+                if self.error: raise self.error
+                if self.latest and self.latest[0] > after_seq and self.latest[2] == area and self.latest[3] >= self.not_before:
+                    seq, slot, _, _ = self.latest
+                    self.held_slot = slot
+                    self.wanted = True # grabbed while this one is matched
+                    self.cond.notify_all()
+                    return seq, self.ring[slot]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return None
+                if not self.wanted:
+                    self.wanted = True
+                    self.cond.notify_all()
+                self.cond.wait(remaining)
+
+    def invalidate(self) -> None:
+        # the frame grabbed ahead predates whatever just happened, the next call waits for a new grab
+        with self.cond:
+            self.not_before = time.monotonic()
+
+    def stop(self) -> None:
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join(timeout=2.0)
+
+
+_tile_shm: Optional[shared_memory.SharedMemory] = None
+
+
+def _tile_worker_init(shm_name: str) -> None:
+    global _tile_shm
+    cv2.setNumThreads(1) # the processes are the parallelism
+    _tile_shm = shared_memory.SharedMemory(name=shm_name)
+
+
+def _match_tile(task: Tuple[Tuple[int, ...], Tuple[int, int, int, int], np.ndarray]) -> Tuple[float, Tuple[int, int]]:
+    shape, (x1, y1, x2, y2), template = task
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=_tile_shm.buf)
+    result = cv2.matchTemplate(frame[y1:y2, x1:x2], template, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    return max_val, (x1 + max_loc[0], y1 + max_loc[1])
+
+
+class TileMatchPool:
+    # persistent worker processes attached to one shared frame buffer; only tile rects and templates are sent
+    def __init__(self, processes: int, max_bytes: int):
+        self.processes = processes
+        self.shm = shared_memory.SharedMemory(create=True, size=max_bytes)
+        self._buffer = np.ndarray((max_bytes,), dtype=np.uint8, buffer=self.shm.buf)
+        self.address = self._buffer.ctypes.data
+        self.pool = multiprocessing.Pool(processes, initializer=_tile_worker_init, initargs=(self.shm.name,))
+        self.tasks = 0
+        self.copies = 0
+
+    def frame(self, shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+        # a frame buffer inside the shared memory, for capturing straight into it
+        size = int(np.prod(shape))
+        if size > self._buffer.size: return None
+        return self._buffer[:size].reshape(shape)
+
+    def holds(self, img: np.ndarray) -> bool:
+        return img.ctypes.data == self.address and img.flags.c_contiguous
+
+    def load(self, img: np.ndarray) -> np.ndarray:
+        # frames captured elsewhere (capture thread ring) are copied in once
+        if self.holds(img): return img
+        frame = self.frame(img.shape)
+        if frame is None: return img
+        np.copyto(frame, img)
+        self.copies += 1
+        return frame
+
+    def match(self, shape: Tuple[int, ...], tiles: List[Tuple[int, int, int, int]], template: np.ndarray) -> List[Tuple[float, Tuple[int, int]]]:
+        self.tasks += len(tiles)
+        return self.pool.map(_match_tile, [(shape, tile, template) for tile in tiles], chunksize=1)
+
+    def close(self) -> None:
+        if self.pool is None: return
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+        del self._buffer
+        try:
+            self.shm.close()
+        except BufferError: # a frame view is still around, the memory goes away with the process
+            pass
+        self.shm.unlink()
+
+
+class FrameChangeDetector:
+    # compares per-tile mean colours against the frame of the last full scan of the current state,
+    # so slow fades still add up to a change
+    def __init__(self, tile_size: int, threshold: float, full_scan_every: int):
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.full_scan_every = full_scan_every
+        self.reference: Optional[np.ndarray] = None
+        self.context = None
+        self.since_full_scan = 0
+        self.frames = 0
+        self.skipped = 0
+        self.partial = 0
+
+    def reset(self) -> None:
+        self.reference = None
+
+    def dirty_regions(self, screen_img: np.ndarray, context) -> Optional[List[Tuple[int, int, int, int]]]:
+        # None: match everything, []: nothing changed, else changed (x1, y1, x2, y2) image rects
+        self.frames += 1
+        if self.threshold <= 0:
+            return None
+        h, w = screen_img.shape[:2]
+        tiles_w, tiles_h = max(1, -(-w // self.tile_size)), max(1, -(-h // self.tile_size))
+        tiles = cv2.resize(screen_img, (tiles_w, tiles_h), interpolation=cv2.INTER_AREA)
+        if (self.reference is None or context != self.context or self.reference.shape != tiles.shape
+                or self.since_full_scan >= self.full_scan_every):
+            self.reference = tiles
+            self.context = context
+            self.since_full_scan = 0
+            return None
+        self.since_full_scan += 1
+
+        diff = cv2.absdiff(tiles, self.reference)
+        mask = (diff.max(axis=2) if diff.ndim == 3 else diff) > self.threshold
+        if not mask.any():
+            self.skipped += 1
+            return []
+        self.partial += 1
+
+        scale_x, scale_y = w / tiles_w, h / tiles_h
+        mask = cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        boxes = [(x, y, x + bw, y + bh) for x, y, bw, bh, _ in stats[1:count]]
+        if len(boxes) > CHANGE_MAX_REGIONS:
+            boxes = [(min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))]
+        return [(int(x1 * scale_x), int(y1 * scale_y), min(w, int(np.ceil(x2 * scale_x))), min(h, int(np.ceil(y2 * scale_y))))
+                for x1, y1, x2, y2 in boxes]
+
+    def skip_rate(self) -> float:
+        return self.skipped / self.frames if self.frames else 0.0
+
+
+class DownloadWatcher:
+    # polls download directories: any new file (partial or not) is a started download, a complete file
+    # whose size stopped changing between two polls a finished one
+    def __init__(self, directories: List[str]):
+        self.directories = list(directories)
+        self.known: Dict[str, int] = self._scan() # path -> size
+        # the inode survives a rename, it tells a renamed partial file from a new download; only fetched for
+        # new files (a stat each on windows, and download folders can hold thousands of files)
+        self.inodes: Dict[str, int] = {path: self._inode(path) for path in self.known if self.is_partial(path)}
+        self.pending: Dict[str, int] = {} # complete files not seen finished yet -> last size
+        self.started = 0
+        self.finished = 0
+
+    def _scan(self) -> Dict[str, int]:
+        files = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file(): files[entry.path] = entry.stat().st_size
+            except OSError as e:
+                logging.warning(f"Can't read download directory {directory}: {e}")
+        return files
+
+    @staticmethod
+    def _inode(path: str) -> int:
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return 0
+
+    @staticmethod
+    def is_partial(path: str) -> bool:
+        return path.lower().endswith(PARTIAL_DOWNLOAD_SUFFIXES)
+
+    @staticmethod
+    def strip_partial(path: str) -> str:
+        suffix = next((suffix for suffix in PARTIAL_DOWNLOAD_SUFFIXES if path.lower().endswith(suffix)), "")
+        return path[:len(path) - len(suffix)]
+
+    def poll(self) -> List[Tuple[str, str]]:
+        files = self._scan()
+        events = []
+        # partial files that went away were renamed (to their final name, or chrome's "Unconfirmed 123.crdownload"
+        # to "<name>.crdownload"): the file under the new name was reported when it started
+        vanished = [path for path in self.known if path not in files and self.is_partial(path)]
+        renamed_inodes = {self.inodes.pop(path, 0) for path in vanished} - {0}
+        renamed_names = {self.strip_partial(path) for path in vanished}
+        for path in files:
+            if path in self.known: continue
+            inode = self._inode(path)
+            if self.is_partial(path): self.inodes[path] = inode
+            else: self.pending[path] = -1
+            if any(path + suffix in files for suffix in PARTIAL_DOWNLOAD_SUFFIXES):
+                continue # empty placeholder next to its partial file (firefox), the partial one is reported
+            if inode in renamed_inodes or path in renamed_names: continue
+            events.append(("started", path))
+        for path, last_size in list(self.pending.items()):
+            size = files.get(path)
+            if size is None:
+                del self.pending[path]
+            elif size == last_size and size > 0:
+                events.append(("finished", path))
+                del self.pending[path]
+            else:
+                self.pending[path] = size
+        self.known = files
+        for kind, path in events:
+            logging.info(f"Download {kind}: {path}")
+            if kind == "started": self.started += 1
+            else: self.finished += 1
+        return events
+
+
+class FlightRecorder:
+    # everything here is cheap enough for the scan loop (a resize and a few appends), encoding and
+    # writing a dump happens on the writer thread
+    def __init__(self, directory: str, max_frames: int, scale: float, max_bytes: int):
+        self.directory = directory
+        self.scale = scale
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frames: deque = deque() # (t, lane, state, area, small frame)
+        self.frame_bytes = 0
+        self.events: deque = deque(maxlen=FLIGHT_RECORDER_EVENTS)
+        self.lock = threading.Lock()
+        self.dumps = 0
+        self.dropped_dumps = 0
+        self.pending: queue.Queue = queue.Queue(maxsize=2)
+        self.writer = threading.Thread(target=self._write_dumps, name="flight-recorder", daemon=True)
+        self.writer.start()
+        os.makedirs(directory, exist_ok=True)
+
+    def frame(self, t: float, lane: int, state: str, area: dict, img: np.ndarray) -> None:
+        size = (max(1, int(img.shape[1] * self.scale)), max(1, int(img.shape[0] * self.scale)))
+        small = cv2.resize(img, size, interpolation=cv2.INTER_AREA) # a new array, the capture buffer gets reused
+        with self.lock:
+            self.frames.append((t, lane, state, {k: area[k] for k in ("left", "top", "width", "height")}, small))
+            self.frame_bytes += small.nbytes
+            while self.frames and (len(self.frames) > self.max_frames or self.frame_bytes > self.max_bytes):
+                self.frame_bytes -= self.frames.popleft()[4].nbytes
+
+    def event(self, t: float, kind: str, **data) -> None:
+        with self.lock:
+            self.events.append(dict(t=round(t, 4), kind=kind, **data))
+
+    def dump(self, t: float, reason: str) -> None:
+        # hands a snapshot to the writer, the frames in it are never written to again
+        with self.lock:
+            snapshot = (t, reason, list(self.frames), list(self.events))
+        try:
+            self.pending.put_nowait(snapshot)
+        except queue.Full:
+            self.dropped_dumps += 1
+            logging.warning(f"Flight recorder still writing, dump for '{reason}' dropped.")
+
+    def _write_dumps(self) -> None:
+        while True:
+            snapshot = self.pending.get()
+            if snapshot is None: return
+            t, reason, frames, events = snapshot
+            name = f"flight_{time.strftime('%Y%m%d_%H%M%S')}_{self.dumps:03d}_{reason.split()[0]}.zip"
+            path = os.path.join(self.directory, name)
+            try:
+                with zipfile.ZipFile(path, "w") as archive:
+                    index = []
+                    for i, (frame_t, lane, state, area, small) in enumerate(frames):
+                        ok, png = cv2.imencode(".png", small)
+                        if not ok: continue
+                        filename = f"frame_{i:03d}.png"
+                        archive.writestr(filename, png.tobytes()) # png is compressed already
+                        index.append({"file": filename, "t": round(frame_t, 4), "lane": lane, "state": state, "area": area, "scale": self.scale})
+                    timeline = {"reason": reason, "t": round(t, 4), "frames": index, "events": events}
+                    archive.writestr("timeline.json", json.dumps(timeline, indent=1), compress_type=zipfile.ZIP_DEFLATED)
+                self.dumps += 1
+                logging.warning(f"Flight recorder: {reason}, last {len(frames)} frames and {len(events)} events written to {path}")
+            except (OSError, ValueError) as e:
+                logging.error(f"Flight recorder could not write {path}: {e}")
+
+    def close(self) -> None:
+        # lets a dump of the crash that ended the scan finish
+        self.pending.put(None)
+        self.writer.join(timeout=10.0)
+
+
+class StageProfiler:
+    # wall time per named stage of the scan loop; thread safe, a no-op unless enabled
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages: Dict[str, List[float]] = {} # name -> [calls, total, max]
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+    def stage(self, name: str):
+        return self._timed(name) if self.enabled else contextlib.nullcontext()
+
+    def report(self) -> List[str]:
+        wall = time.perf_counter() - self.start_time
+        with self.lock:
+            rows = sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True)
+        lines = [f"{'stage':<48} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} {'% wall':>7}"]
+        for name, (calls, total, longest) in rows:
+            lines.append(f"{name:<48} {calls:>7} {total:>9.3f} {total / calls * 1000:>9.2f} {longest * 1000:>9.2f} {total / wall * 100:>7.1f}")
+        return lines
+
+
+class RunMetrics:
+    DWELL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+    LATENCY_SAMPLES = 1000 # latest samples kept per stage for percentiles
+
+    def __init__(self, clock: Clock, path: Optional[str], interval: float):
+        self.clock = clock
+        self.path = path
+        self.interval = interval
+        self.start_time = clock.monotonic()
+        self.last_flush = self.start_time
+        self.frames = 0
+        self.cycles = 0
+        self.cycle_durations: deque = deque(maxlen=self.LATENCY_SAMPLES)
+        self.cycle_start_time = self.start_time
+        self.dwell: Dict[str, List[int]] = {} # state -> bucket counts, last one is +Inf
+        self.dwell_sum: Dict[str, float] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.latencies: Dict[str, deque] = {}
+        self.startup: Dict[str, float] = {} # seconds since the script started, per startup milestone
+        self.lock = threading.Lock()
+
+    def record_latency(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(stage, deque(maxlen=self.LATENCY_SAMPLES)).append(seconds)
+
+    def record_dwell(self, state: ScanState, seconds: float) -> None:
+        counts = self.dwell.setdefault(state.name, [0] * (len(self.DWELL_BUCKETS) + 1))
+        counts[next((i for i, edge in enumerate(self.DWELL_BUCKETS) if seconds <= edge), len(self.DWELL_BUCKETS))] += 1
+        self.dwell_sum[state.name] = self.dwell_sum.get(state.name, 0.0) + seconds
+
+    def record_startup(self, milestone: str, seconds: float) -> None:
+        self.startup[milestone] = round(seconds, 4)
+
+    def record_timeout(self, state: ScanState) -> None:
+        self.timeouts[state.name] = self.timeouts.get(state.name, 0) + 1
+
+    def record_cycle(self, now: float) -> None:
+        self.cycles += 1
+        self.cycle_durations.append(now - self.cycle_start_time)
+        self.cycle_start_time = now
+
+    def mods_per_hour(self) -> float:
+        elapsed = self.clock.monotonic() - self.start_time
+        return self.cycles * 3600.0 / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def _percentile(ordered: List[float], q: float) -> Optional[float]:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+    def latency_percentiles(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.latencies.items()}
+        return {stage: {f"p{int(q * 100)}": round(self._percentile(ordered, q), 5) for q in (0.5, 0.9, 0.99)}
+                for stage, ordered in samples.items() if ordered}
+
+    def summary(self) -> dict:
+        durations = sorted(self.cycle_durations)
+        return {
+            "frames_captured": self.frames,
+            "cycles_completed": self.cycles,
+            "mods_per_hour": round(self.mods_per_hour(), 2),
+            "cycle_time_mean": sum(durations) / len(durations) if durations else None,
+            "cycle_time_median": self._percentile(durations, 0.5),
+            "timeouts": dict(self.timeouts),
+            "dwell_mean": {state: round(self.dwell_sum[state] / sum(counts), 3) for state, counts in self.dwell.items()},
+            "latency": self.latency_percentiles(),
+            "startup": dict(self.startup),
+        }
+
+    def maybe_flush(self, stats: Callable[[], dict]) -> None:
+        now = self.clock.monotonic()
+        if self.path and now - self.last_flush >= self.interval:
+            self.last_flush = now
+            self.flush(stats())
+
+    def flush(self, extra: dict) -> None:
+        if not self.path: return
+        try:
+            if self.path.endswith(".prom"):
+                # textfile collector format, replaced atomically so scrapers never see half a file
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(self.prometheus_text(extra))
+                os.replace(tmp_path, self.path)
+            else:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(dict(extra, time=time.time())) + "\n")
+        except OSError as e:
+            logging.error(f"Could not write metrics to {self.path}: {e}")
+
+    def prometheus_text(self, extra: dict) -> str:
+        lines = [
+            "# TYPE smnexus_cycles_total counter", f"smnexus_cycles_total {self.cycles}",
+            "# TYPE smnexus_frames_total counter", f"smnexus_frames_total {self.frames}",
+            "# TYPE smnexus_mods_per_hour gauge", f"smnexus_mods_per_hour {self.mods_per_hour():.3f}",
+            "# TYPE smnexus_state_timeouts_total counter",
+        ]
+        lines += [f'smnexus_state_timeouts_total{{state="{state}"}} {count}' for state, count in self.timeouts.items()]
+        lines.append("# TYPE smnexus_state_dwell_seconds histogram")
+        for state, counts in self.dwell.items():
+            cumulative = 0
+            for edge, count in zip(list(self.DWELL_BUCKETS) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'smnexus_state_dwell_seconds_bucket{{state="{state}",le="{edge}"}} {cumulative}')
+            lines.append(f'smnexus_state_dwell_seconds_sum{{state="{state}"}} {self.dwell_sum[state]:.4f}')
+            lines.append(f'smnexus_state_dwell_seconds_count{{state="{state}"}} {cumulative}')
+        lines.append("# TYPE smnexus_latency_seconds summary")
+        for stage, quantiles in self.latency_percentiles().items():
+            for name, value in quantiles.items():
+                lines.append(f'smnexus_latency_seconds{{stage="{stage}",quantile="{int(name[1:]) / 100}"}} {value}')
+        lines.append("# TYPE smnexus_startup_seconds gauge")
+        lines += [f'smnexus_startup_seconds{{milestone="{milestone}"}} {value}' for milestone, value in self.startup.items()]
+        # the rest of the run stats as one labelled gauge, leaving out what's already exported above
+        lines.append("# TYPE smnexus_stat gauge")
+        own = self.summary()
+        for name, value in extra.items():
+            if name not in own and isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'smnexus_stat{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self, wall_time: float) -> None:
+        summary = self.summary()
+        fps = self.frames / wall_time if wall_time > 0 else 0.0
+        logging.warning(f"Run summary: {self.cycles} cycles ({summary['mods_per_hour']} mods/hour), {self.frames} frames "
+                        f"in {wall_time:.2f}s ({fps:.1f} frames/s), median cycle {summary['cycle_time_median']}")
+        if summary["startup"]: logging.warning("Startup: " + ", ".join(f"{name} at {value:.3f}s" for name, value in summary["startup"].items()))
+        if summary["timeouts"]: logging.warning(f"Timeouts per state: {summary['timeouts']}")
+        logging.warning(f"Mean dwell per state (s): {summary['dwell_mean']}")
+        for stage, quantiles in summary["latency"].items():
+            logging.warning(f"Latency {stage}: " + ", ".join(f"{name}={value * 1000:.1f}ms" for name, value in quantiles.items()))
+
+
+@dataclass
+class ScanLane:
+    # one download pipeline: its own state machine, browser window (or fixed screen region) and change history
+    index: int
+    state_transition_time: float = 0.0
+    browser_hwnd: Optional[int] = None
+    region: Optional[Tuple[int, int, int, int]] = None # --lane-region, searched instead of the browser window rect
+    current_state: ScanState = ScanState.INIT
+    settling: bool = False
+    settle_started: bool = False
+    last_click_location: Optional[Tuple[int, int]] = None
+    best_scores: Dict[str, float] = field(default_factory=dict) # best score per key since the state was entered, logged on timeout
+    last_click_key: Optional[str] = None
+    last_click_signature: Optional[np.ndarray] = None # of the frame the button was found in, for the click index
+    calibration_plan: Optional[DetectionPlan] = None # timed out, scale calibration runs once the tick is done
+    burst_until: float = 0.0 # with window events: normal scan intervals until then, the slow safety net after
+    change_detector: FrameChangeDetector = field(default_factory=lambda: FrameChangeDetector(CHANGE_TILE_SIZE, CHANGE_THRESHOLD, CHANGE_FULL_SCAN_EVERY))
+    due: float = 0.0 # clock time of the lane's next step
+    web_clicked_at: Optional[float] = None # last click on the download page, later downloads belong to this lane
+    download_confirmed: bool = False
+    download_retries: int = 0
+
+
+class InputArbiter:
+    # there is one cursor and one foreground window: lanes take turns, and a lane's browser window is
+    # brought to the front before its input so new tabs and clicks land in the right window
+    def __init__(self, input_backend: InputBackend, window_backend: WindowBackend, clock: Clock, gap: float):
+        self.input_backend = input_backend
+        self.window_backend = window_backend
+        self.clock = clock
+        self.gap = gap
+        self.lock = threading.Lock()
+        self.last_input: Optional[float] = None
+        self.focused: Optional[int] = None
+        self.focus_changes = 0
+
+    def _take_turn(self, hwnd: Optional[int]) -> None:
+        if self.last_input is not None and self.gap > 0:
+            wait = self.gap - (self.clock.monotonic() - self.last_input)
+            if wait > 0: self.clock.sleep(wait)
+        if hwnd and hwnd != self.focused:
+            try:
+                self.window_backend.focus_window(hwnd)
+                self.focus_changes += 1
+            except Exception as e:
+                logging.warning(f"Could not focus window {hwnd}: {e}")
+            self.focused = hwnd
+
+    def click(self, x: int, y: int, hwnd: Optional[int] = None) -> None:
+        with self.lock:
+            self._take_turn(hwnd)
+            try:
+                self.input_backend.click(x, y)
+            finally:
+                self.last_input = self.clock.monotonic()
+
+    def close_tab(self, hwnd: int, count: int = 1) -> None:
+        with self.lock:
+            self._take_turn(None)
+            try:
+                self.input_backend.close_tab(hwnd, count)
+            finally:
+                self.focused = hwnd
+                self.last_input = self.clock.monotonic()
+
+
+class TabManager:
+    # counts the nexus tabs left open per browser window and closes them in one batch once a window is over
+    # the tab or memory budget, instead of a ctrl+w (and its focus dance) in front of every vortex click
+    def __init__(self, arbiter: InputArbiter, window_backend: WindowBackend, tab_budget: int, memory_budget_mb: float):
+        self.arbiter = arbiter
+        self.window_backend = window_backend
+        self.tab_budget = max(1, tab_budget)
+        self.memory_budget_mb = memory_budget_mb
+        self.open_tabs: Dict[int, int] = {}
+        self.closed = 0
+        self.batches = 0
+        self.failures = 0
+        self.peak_memory_mb = 0.0
+
+    def opened(self, hwnd: int) -> None:
+        self.open_tabs[hwnd] = self.open_tabs.get(hwnd, 0) + 1
+
+    def _over_budget(self, hwnd: int) -> Optional[str]:
+        tabs = self.open_tabs.get(hwnd, 0)
+        if not tabs: return None
+        if tabs >= self.tab_budget: return f"{tabs} tabs open"
+        if self.memory_budget_mb > 0:
+            try:
+                memory = self.window_backend.process_memory(hwnd)
+            except Exception as e:
+                logging.warning(f"Could not read browser memory: {e}")
+                memory = None
+            if memory is not None:
+                memory_mb = memory / 2**20
+                self.peak_memory_mb = max(self.peak_memory_mb, memory_mb)
+                if memory_mb > self.memory_budget_mb: return f"browser uses {memory_mb:.0f} MB"
+        return None
+
+    def maybe_close(self, hwnd: int) -> None:
+        reason = self._over_budget(hwnd)
+        if not reason: return
+        tabs = self.open_tabs[hwnd]
+        logging.info(f"Closing {tabs} browser tabs ({reason}).")
+        try:
+            self.arbiter.close_tab(hwnd, tabs)
+            self.closed += tabs
+            self.batches += 1
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"Failed to close browser tabs of window {hwnd}: {e}")
+        self.open_tabs[hwnd] = 0 # closed, or the window is gone; either way not retried
+
+    def summary(self) -> dict:
+        return {"tabs_closed": self.closed, "tab_close_batches": self.batches, "tab_close_failures": self.failures,
+                "tabs_open": sum(self.open_tabs.values()), "browser_memory_peak_mb": round(self.peak_memory_mb, 1)}
+
+
 class System:
-    def __init__(self, browser: Optional[str] = None, vortex: bool = False, verbose: bool = False, force_primary: bool = False):
-        self.browser = browser.lower()
-        self.browser_closed = True
+    def __init__(self, browser: Optional[str] = None, vortex: bool = False, verbose: bool = False, force_primary: bool = False,
+                 capture_backend: Optional[CaptureBackend] = None, input_backend: Optional[InputBackend] = None,
+                 window_backend: Optional[WindowBackend] = None, clock: Optional[Clock] = None,
+                 config: Optional[ScanConfig] = None, metrics_file: Optional[str] = None, profile: bool = False,
+                 lanes: int = 1, lane_regions: Optional[List[Tuple[int, int, int, int]]] = None,
+                 download_dirs: Optional[List[str]] = None, window_events: Optional[WindowEventSource] = None,
+                 flight_recorder_dir: Optional[str] = None):
+        self.browser = browser.lower() if browser else None
         log_level = logging.INFO if verbose else logging.WARNING
         logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
 
         logging.info("Initializing system...")
         logging.info(f"Arguments: browser={browser}, vortex={vortex}, verbose={verbose}, force_primary={force_primary}")
 
+        self.clock = clock or Clock()
+        self.config = config or ScanConfig()
+        self.profiler = StageProfiler(profile)
+        self.metrics = RunMetrics(self.clock, metrics_file, self.config.metrics_interval)
+        self.flight_recorder = FlightRecorder(flight_recorder_dir, FLIGHT_RECORDER_FRAMES, FLIGHT_RECORDER_SCALE,
+                                              int(FLIGHT_RECORDER_MAX_MB * 1024 * 1024)) if flight_recorder_dir else None
+        self.window_backend = window_backend or Win32WindowBackend()
+        self.input_backend = input_backend or INPUT_BACKENDS[self.config.click_method]()
+        self.lane = self._new_lane(0, state_transition_time=self.clock.monotonic())
+        self.lanes = [self.lane]
+        self.vortex_owner: Optional[ScanLane] = None
+
         self.monitors = self._get_monitors()
         if not self.monitors:
             logging.error("No monitors found. Exiting.")
@@ -95,7 +1885,7 @@ class System:
         self._calculate_monitor_geometry()
 
         try:
-            self.button_templates: Dict[str, List[np.ndarray]] = self._load_assets(BUTTON_ASSETS, ASSET_DIRECTORY)
+            self.button_templates: Dict[str, List[ButtonTemplate]] = self._load_assets(BUTTON_ASSETS, ASSET_DIRECTORY)
             logging.info("Loaded button assets.")
             if not self.button_templates:
                  raise RuntimeError("No button assets were loaded. Check configuration and asset files.")
@@ -103,63 +1893,62 @@ class System:
             logging.error(f"Asset loading failed: {e}")
             raise
 
-        self.screen_capturer = mss.mss()
-        self.capture_area = self._define_capture_area()
+        self.capture_backend = capture_backend or MssCaptureBackend()
+        self.capture_thread = CaptureThread(self.capture_backend) if self.config.capture_thread else None
+        self._frame_seq = 0
+        self._frame_buffer: Optional[np.ndarray] = None
+        self.desktop_area = self._define_capture_area()
+        self.capture_area = self.desktop_area
+        self.window_handles: Dict[str, int] = {}
         logging.info(f"Screen capture area set to: {self.capture_area}")
 
         if browser:
             self._prepare_browser()
         if vortex:
             self._prepare_vortex()
+        if lanes > 1 or lane_regions:
+            self._prepare_lanes(lanes, lane_regions or [])
+        self.input_arbiter = InputArbiter(self.input_backend, self.window_backend, self.clock, LANE_CLICK_GAP if len(self.lanes) > 1 else 0.0)
+        self.tab_manager = TabManager(self.input_arbiter, self.window_backend, self.config.tab_budget, self.config.browser_memory_budget_mb)
 
         self.use_vortex_logic = vortex
         self.verbose = verbose
 
-        self.current_state = ScanState.INIT
-        self.state_transition_time = time.monotonic()
-        self.last_click_location: Optional[Tuple[int, int]] = None
-
-        self.match_thresholds = {
-            "vortex_dl": VORTEX_DL_MATCH_THRESHOLD,
-            "web_dl": WEB_DL_MATCH_THRESHOLD,
-            "click_here": CLICK_HERE_MATCH_THRESHOLD,
-            "vortex_cont": VORTEX_CONT_MATCH_THRESHOLD,
-            "understood": UNDERSTOOD_MATCH_THRESHOLD,
-            "staging": STAGING_MATCH_THRESHOLD,
-        }
+        self.scheduler = ScanScheduler(self.config.post_click_delay) if self.config.adaptive_scan else None
+
+        self._derived_source: Optional[np.ndarray] = None
+        self._derived_frames: Dict[str, np.ndarray] = {}
+        self._derived_lock = threading.Lock()
+        self.hit_cache = HitCache(self.config.hit_cache_size, HIT_CACHE_RADIUS)
+        self.click_index = ClickIndex(self.config.click_cooldown, CLICK_RADIUS, CLICK_SIGNATURE_THRESHOLD)
+        self.download_watcher = DownloadWatcher(download_dirs) if download_dirs else None
+        self.download_events: deque = deque() # clock times of started downloads no lane has claimed yet
+        self.download_retries = 0
+        self.window_events = window_events
+        self.missing_windows: set = set() # windows not found since the last window event, not looked up again until one
+        self.event_wakeups = 0
+        self.detection_pool = ThreadPoolExecutor(self.config.detection_workers, thread_name_prefix="detect") if self.config.detection_workers > 1 else None
+        self.tile_pool = TileMatchPool(self.config.match_processes, self.full_width * self.full_height * 3) if self.config.match_processes > 0 else None
+
+        self.match_thresholds = dict(self.config.match_thresholds)
+        self.matcher_modes = dict(self.config.matcher_modes)
+        self.state_plans = compile_state_plans(STATE_GRAPH, self.config, self.matcher_modes, self.use_vortex_logic, len(self.lanes) > 1)
+        self.prefilter_thresholds = {key: self.config.gray_prefilter_threshold for key in BUTTON_ASSETS}
+        self.match_stats = MatchStats()
+        self.score_histograms = ScoreHistograms(SCORE_BINS)
+        logging.info(f"Matchers: {self.matcher_modes}")
+
+        self.window_scales: Dict[str, float] = self._load_scale_cache() # "<window>@<monitor>" -> template scale
+        self.key_scales: Dict[str, float] = {}
+        self.scale_verified: set = set() # windows where buttons matched at their current scale
+        self.unconfirmed_scales: set = set() # calibrated this run, not saved until a button is found at the scale
+        self.calibration_attempts: Dict[str, int] = {}
+        self._refresh_template_scales()
 
         logging.info("System initialization complete.")
 
     def _get_monitors(self) -> List[dict]:
-        monitors_raw = win32api.EnumDisplayMonitors(None, None)
-        monitor_details = []
-        primary_monitor_found = False
-        if not monitors_raw:
-             return []
-
-        for i, monitor in enumerate(monitors_raw):
-            try:
-                monitor_info = win32api.GetMonitorInfo(monitor[0].handle)
-                rect = monitor[2]
-                is_primary = monitor_info.get("Flags") == win32con.MONITORINFOF_PRIMARY
-                details = {
-                    "handle": monitor[0].handle,
-                    "device": monitor_info.get("Device", f"Unknown_{i}"),
-                    "left": rect[0],
-                    "top": rect[1],
-                    "width": rect[2] - rect[0],
-                    "height": rect[3] - rect[1],
-                    "is_primary": is_primary
-                }
-                monitor_details.append(details)
-                if is_primary:
-                    primary_monitor_found = True
-            except Exception as e:
-                 logging.error(f"Could not get info for monitor {i}: {e}")
-
-        if not primary_monitor_found and monitor_details:
-             monitor_details[0]['is_primary'] = True # Fallback
-
+        monitor_details = self.window_backend.get_monitors()
         monitor_details.sort(key=lambda m: not m['is_primary']) # Primary first
         return monitor_details
 
@@ -190,9 +1979,138 @@ class System:
             "mon": 0,
         }
 
-    def _load_assets(self, asset_config: Dict[str, List[str]], asset_dir: str) -> Dict[str, List[np.ndarray]]:
-        loaded_templates: Dict[str, List[np.ndarray]] = {}
+    def _templates(self, button_key: str) -> List[ButtonTemplate]:
+        templates = self.button_templates.get(button_key) or []
+        scale = self.key_scales.get(button_key, 1.0)
+        return templates if scale == 1.0 else [template.at_scale(scale) for template in templates]
+
+    def _scale_key(self, window: Optional[str]) -> str:
+        # display scaling is per monitor and zoom per window, so a scale belongs to a window on a monitor
+        rect = self._window_rect(window) if window else None
+        monitor = self.monitors[0]
+        if rect:
+            cx, cy = (rect[0] + rect[2]) // 2, (rect[1] + rect[3]) // 2
+            monitor = next((m for m in self.monitors if m['left'] <= cx < m['left'] + m['width'] and m['top'] <= cy < m['top'] + m['height']), monitor)
+        return f"{window or 'desktop'}@{monitor.get('device', '?')}:{monitor['width']}x{monitor['height']}"
+
+    def _refresh_template_scales(self) -> None:
+        # windows move between monitors, so the scale of every button is looked up again each scan
+        if not self.window_scales and not self.key_scales: return # (a dropped scale still has to be undone)
+        window_scales = {window: self.window_scales.get(self._scale_key(window), 1.0) for window in set(BUTTON_WINDOWS.values())}
+        key_scales = {key: window_scales[window] for key, window in BUTTON_WINDOWS.items()}
+        if key_scales == self.key_scales: return
+        logging.info(f"Template scales: {key_scales}")
+        self.key_scales = key_scales
+        self.hit_cache.invalidate("template scale changed")
+        for key, scale in key_scales.items(): # resize now, not in the middle of a scan
+            mode = self.matcher_modes.get(key, "full")
+            for template in self._templates(key):
+                if mode == "pyramid": template.downscaled(PYRAMID_FACTOR)
+                if mode == "gray": template.gray()
+
+    def _load_scale_cache(self) -> Dict[str, float]:
+        path = os.path.join(ASSET_DIRECTORY, SCALE_CACHE_FILE)
+        if not os.path.isfile(path): return {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable scale cache {path}: {e}")
+            return {}
+        if data.get("assets") != self.assets_digest:
+            logging.info("Assets changed since the last scale calibration, calibrating again.")
+            return {}
+        logging.info(f"Calibrated scales: {data.get('scales')}")
+        return {key: float(scale) for key, scale in data.get("scales", {}).items()}
+
+    def _save_scale_cache(self) -> None:
+        path = os.path.join(ASSET_DIRECTORY, SCALE_CACHE_FILE)
+        try:
+            with open(path, "w") as f:
+                scales = {key: scale for key, scale in self.window_scales.items() if key not in self.unconfirmed_scales}
+                json.dump({"assets": self.assets_digest, "scales": scales}, f, indent=1)
+        except OSError as e:
+            logging.warning(f"Could not write scale cache {path}: {e}")
+
+    def _save_score_histograms(self) -> None:
+        # added to what earlier runs collected with the same assets
+        path = os.path.join(ASSET_DIRECTORY, SCORE_HISTOGRAM_FILE)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("assets") == self.assets_digest: self.score_histograms.merge(data.get("counts", {}))
+            else: logging.info("Assets changed since the scores were collected, starting new histograms.")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable score histograms {path}: {e}")
+        try:
+            with open(path, "w") as f:
+                json.dump({"assets": self.assets_digest, "bins": SCORE_BINS, "counts": self.score_histograms.counts}, f)
+        except OSError as e:
+            logging.warning(f"Could not write score histograms {path}: {e}")
+
+    def _verify_scale(self, key: str) -> None:
+        self.scale_verified.add(key)
+        if key in self.unconfirmed_scales:
+            logging.warning(f"Scale calibration for {key}: found a button at {self.window_scales[key]}x, saving it.")
+            self.unconfirmed_scales.discard(key)
+            self._save_scale_cache()
+
+    def _calibrate_scales(self, plan: DetectionPlan) -> None:
+        # a state timed out: search its buttons once at every scale, for windows whose scale isn't known yet
+        pending: Dict[str, Tuple[Optional[str], List[str]]] = {}
+        for rule in plan.rules:
+            window = BUTTON_WINDOWS.get(rule.button_key)
+            key = self._scale_key(window)
+            if key in self.unconfirmed_scales: # timed out again at the calibrated scale, it was a look-alike
+                logging.warning(f"Scale calibration for {key}: nothing found at {self.window_scales[key]}x since, dropping it.")
+                self.unconfirmed_scales.discard(key)
+                del self.window_scales[key]
+            if key in self.window_scales or key in self.scale_verified or self.calibration_attempts.get(key, 0) >= CALIBRATION_ATTEMPTS:
+                continue
+            pending.setdefault(key, (window, []))[1].append(rule.button_key)
+        if not pending: return
+        screen_img = self.capture_screen(self._scoped_capture_area(plan.capture_windows))
+        if screen_img is None: return
+        for key, (window, button_keys) in pending.items():
+            self.calibration_attempts[key] = self.calibration_attempts.get(key, 0) + 1
+            started = time.perf_counter()
+            search_bbox = self._window_rect(window) if window else None
+            best = None
+            reference = 0.0 # best score at the asset size, whatever the threshold
+            for button_key in button_keys:
+                threshold = self.match_thresholds.get(button_key, DEFAULT_MATCH_THRESHOLD)
+                for scale in CALIBRATION_SCALES:
+                    for template in self.button_templates.get(button_key) or []:
+                        if scale == 1.0:
+                            result = self._detect_single_template(screen_img, template, -1.0, search_bbox, "full", button_key, record=False)
+                            if result: reference = max(reference, result[0])
+                            continue
+                        # coarse to fine whatever the key's matcher, this is many templates over one frame
+                        result = self._detect_single_template(screen_img, template.at_scale(scale), threshold, search_bbox, "pyramid", button_key, record=False)
+                        if result and (best is None or result[0] > best[0]): best = (result[0], scale, button_key)
+            took = time.perf_counter() - started
+            if best is None:
+                logging.info(f"Scale calibration for {key}: no button at any scale (attempt {self.calibration_attempts[key]}/{CALIBRATION_ATTEMPTS}, {took:.2f}s).")
+                continue
+            score, scale, button_key = best
+            if score < reference + CALIBRATION_MARGIN:
+                logging.info(f"Scale calibration for {key}: '{button_key}' at {scale}x ({score:.3f}) isn't clearly better than at 1.0x ({reference:.3f}), keeping 1.0x.")
+                continue
+            logging.warning(f"Scale calibration for {key}: buttons are drawn at {scale}x ('{button_key}' matched {score:.3f}, {reference:.3f} at 1.0x, {took:.2f}s).")
+            self.window_scales[key] = scale
+            self.unconfirmed_scales.add(key)
+        self._refresh_template_scales()
+
+    def _load_assets(self, asset_config: Dict[str, List[str]], asset_dir: str) -> Dict[str, List[ButtonTemplate]]:
+        started = time.perf_counter()
+        cache_path = os.path.join(asset_dir, TEMPLATE_CACHE_FILE)
+        cache = self._read_template_cache(cache_path)
+        loaded_templates: Dict[str, List[ButtonTemplate]] = {}
+        by_hash: Dict[str, ButtonTemplate] = {}
         total_loaded = 0
+        from_cache = 0
         for btn_key, filenames in asset_config.items():
             loaded_templates[btn_key] = []
             if not filenames:
@@ -203,48 +2121,290 @@ class System:
                 if not os.path.isfile(path):
                     logging.warning(f"Asset file not found, skipping: {path} (for key '{btn_key}')")
                     continue
-                img = cv2.imread(path, cv2.IMREAD_COLOR)
-                if img is None:
-                    logging.warning(f"Could not load image, skipping: {path} (for key '{btn_key}')")
-                    continue
-                loaded_templates[btn_key].append(img)
+                with open(path, "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha1(data).hexdigest()
+                forms = cache.get(digest)
+                if forms and "image" in forms:
+                    template = ButtonTemplate(forms["image"], filename)
+                    template.derived.update((form, image) for form, image in forms.items() if form != "image")
+                    from_cache += 1
+                else:
+                    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                    if img is None:
+                        logging.warning(f"Could not load image, skipping: {path} (for key '{btn_key}')")
+                        continue
+                    template = ButtonTemplate(img, filename)
+                    template.downscaled(PYRAMID_FACTOR)
+                    template.gray()
+                by_hash[digest] = template
+                loaded_templates[btn_key].append(template)
                 total_loaded += 1
-                logging.info(f"Loaded asset: {filename} (shape: {img.shape}) for key '{btn_key}'")
+                logging.info(f"Loaded asset: {filename} (shape: {template.image.shape}) for key '{btn_key}'")
             if not loaded_templates[btn_key]:
                  logging.error(f"Failed to load any assets for button key '{btn_key}'. Check filenames/paths in config. Everything will be broken!")
-        logging.info(f"Total assets loaded: {total_loaded}")
+        self.assets_digest = hashlib.sha1("".join(sorted(by_hash)).encode()).hexdigest()
+        if from_cache < total_loaded or set(cache) - set(by_hash):
+            self._write_template_cache(cache_path, by_hash)
+        self.metrics.record_startup("assets loaded", time.perf_counter() - PROCESS_START)
+        logging.info(f"Total assets loaded: {total_loaded} ({from_cache} from {TEMPLATE_CACHE_FILE}) in {(time.perf_counter() - started) * 1000:.1f} ms")
         return loaded_templates
 
+    @staticmethod
+    def _read_template_cache(path: str) -> Dict[str, Dict[str, np.ndarray]]:
+        # one json line indexing the arrays, then all their bytes; a single read, no png decoding
+        cache: Dict[str, Dict[str, np.ndarray]] = {}
+        if not os.path.isfile(path): return cache
+        try:
+            with open(path, "rb") as f:
+                index = json.loads(f.readline())
+                data = np.fromfile(f, dtype=np.uint8)
+            for digest, form, offset, shape in index:
+                size = int(np.prod(shape))
+                cache.setdefault(digest, {})[form] = data[offset:offset + size].reshape(shape)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable template cache {path}: {e}")
+            return {}
+        return cache
 
-    def capture_screen(self) -> np.ndarray:
-        sct_img = self.screen_capturer.grab(self.capture_area)
-        img = cv2.cvtColor(np.array(sct_img), cv2.COLOR_BGRA2BGR)
+    @staticmethod
+    def _write_template_cache(path: str, templates: Dict[str, ButtonTemplate]) -> None:
+        index, chunks, offset = [], [], 0
+        for digest, template in templates.items():
+            for form, image in [("image", template.image)] + list(template.derived.items()):
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+                index.append((digest, form, offset, list(image.shape)))
+                chunks.append(image.tobytes())
+                offset += image.nbytes
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps(index).encode() + b"\n")
+                for chunk in chunks: f.write(chunk)
+            os.replace(tmp_path, path)
+            logging.info(f"Template cache written to {path}")
+        except OSError as e:
+            logging.info(f"Could not write template cache {path}: {e}") # read only install, just slower starts
+
+
+    def _scoped_capture_area(self, window_names: Tuple[str, ...]) -> dict:
+        # bounding box of the given windows clipped to the desktop, whole desktop if any is missing
+        rects = [self._window_rect(name) for name in window_names]
+        if not self.config.window_scoped_capture or not rects or None in rects:
+            return self.desktop_area
+        left = max(min(r[0] for r in rects), self.min_left)
+        top = max(min(r[1] for r in rects), self.min_top)
+        right = min(max(r[2] for r in rects), self.max_right)
+        bottom = min(max(r[3] for r in rects), self.max_bottom)
+        if left >= right or top >= bottom: # minimized or off screen
+            return self.desktop_area
+        return {"top": top, "left": left, "width": right - left, "height": bottom - top, "mon": 0}
+
+    def capture_screen(self, area: Optional[dict] = None) -> Optional[np.ndarray]:
+        area = area or self.desktop_area
+        if area != self.capture_area:
+            logging.info(f"Screen capture area set to: {area}")
+            self.capture_area = area
+        # frame pixel (0, 0) is the top left corner of the captured area
+        self.offset_x, self.offset_y = -area["left"], -area["top"]
+        if self.capture_thread:
+            with self.profiler.stage("capture (wait for capture thread)"):
+                frame = self.capture_thread.next_frame(self._frame_seq, area)
+            if frame is None: return None
+            self._frame_seq, img = frame
+        else:
+            with self.profiler.stage("capture"):
+                sct_img = self.capture_backend.grab(area)
+            with self.profiler.stage("convert BGRA->BGR"):
+                if self._frame_buffer is None or self._frame_buffer.shape[:2] != sct_img.shape[:2]:
+                    shape = (sct_img.shape[0], sct_img.shape[1], 3)
+                    self._frame_buffer = self.tile_pool.frame(shape) if self.tile_pool else None
+                    if self._frame_buffer is None: self._frame_buffer = np.empty(shape, dtype=np.uint8)
+                img = cv2.cvtColor(sct_img, cv2.COLOR_BGRA2BGR, dst=self._frame_buffer)
+        if self.tile_pool:
+            img = self.tile_pool.load(img)
+        if self.metrics.frames == 0:
+            self.metrics.record_startup("first scan", time.perf_counter() - PROCESS_START)
+        if self.flight_recorder:
+            self.flight_recorder.frame(self.clock.monotonic(), self.lane.index, self.lane.current_state.name, area, img)
+        self.metrics.frames += 1
+        with self._derived_lock:
+            self._derived_frames.clear()
         return img
 
-    @staticmethod
-    def _click(x: int, y: int) -> None:
+    def _derived_frame(self, screen_img: np.ndarray, form: str) -> np.ndarray:
+        # per-frame preprocessing shared by every template matched against the same frame
+        with self._derived_lock:
+            return self._derived_frame_locked(screen_img, form)
+
+    def _derived_frame_locked(self, screen_img: np.ndarray, form: str) -> np.ndarray:
+        if self._derived_source is not screen_img:
+            self._derived_frames.clear()
+            self._derived_source = screen_img
+        if form not in self._derived_frames:
+            if form.startswith("pyr"):
+                factor = int(form[3:])
+                size = (max(1, screen_img.shape[1] // factor), max(1, screen_img.shape[0] // factor))
+                self._derived_frames[form] = cv2.resize(screen_img, size, interpolation=cv2.INTER_AREA)
+            elif form == "gray":
+                self._derived_frames[form] = cv2.cvtColor(screen_img, cv2.COLOR_BGR2GRAY)
+            else:
+                raise ValueError(f"Unknown frame form '{form}'")
+        return self._derived_frames[form]
+
+    def _click(self, x: int, y: int) -> None:
         try:
-            original_pos = win32api.GetCursorPos()
-            win32api.SetCursorPos((x, y))
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, x, y, 0, 0)
-            time.sleep(0.05)
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, x, y, 0, 0)
-            time.sleep(0.05)
-            win32api.SetCursorPos(original_pos)
-            logging.info(f"Clicked at screen coordinates: ({x}, {y})")
+            with self.profiler.stage("click"):
+                self.input_arbiter.click(x, y, self.lane.browser_hwnd if len(self.lanes) > 1 else None)
+            logging.info(f"{self._lane_tag()}Clicked at screen coordinates: ({x}, {y})")
+            if self.capture_thread: self.capture_thread.invalidate()
+            if self.flight_recorder: self.flight_recorder.event(self.clock.monotonic(), "click", lane=self.lane.index, x=x, y=y)
         except Exception as e:
             logging.error(f"Failed to perform click at ({x}, {y}): {e}")
 
+    @staticmethod
+    def _match_template(search_region: np.ndarray, template_img: np.ndarray) -> Optional[Tuple[float, Tuple[int, int]]]:
+        try:
+             result = cv2.matchTemplate(search_region, template_img, cv2.TM_CCOEFF_NORMED)
+        except cv2.error as e:
+             logging.warning(f"cv2.matchTemplate failed: {e}. Search shape: {search_region.shape}, Template shape: {template_img.shape}")
+             return None
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    @staticmethod
+    def _peaks(result: np.ndarray, min_score: float, count: int, suppress_w: int, suppress_h: int) -> List[Tuple[int, int]]:
+        # best few local maxima of a match result, each one blanks its neighbourhood
+        peaks = []
+        for _ in range(count):
+            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+            if max_val < min_score: break
+            x, y = max_loc
+            result[max(0, y - suppress_h // 2):y + suppress_h // 2 + 1, max(0, x - suppress_w // 2):x + suppress_w // 2 + 1] = -1.0
+            peaks.append(max_loc)
+        return peaks
+
+    def _confirm_candidates(self,
+                            search_region: np.ndarray,
+                            template: ButtonTemplate,
+                            candidates: List[Tuple[int, int]],
+                            pad: int
+                           ) -> Optional[Tuple[float, Tuple[int, int]]]:
+        # full resolution colour match in a small roi around each candidate top left corner
+        region_h, region_w = search_region.shape[:2]
+        best = None
+        for x, y in candidates:
+            rx1, ry1 = max(0, x - pad), max(0, y - pad)
+            rx2, ry2 = min(region_w, x + pad + template.width), min(region_h, y + pad + template.height)
+            if rx2 - rx1 < template.width or ry2 - ry1 < template.height: continue
+            match = self._match_template(search_region[ry1:ry2, rx1:rx2], template.image)
+            if match and (best is None or match[0] > best[0]):
+                best = match[0], (rx1 + match[1][0], ry1 + match[1][1])
+        return best
+
+    def _match_pyramid(self,
+                       screen_img: np.ndarray,
+                       region_img: Tuple[int, int, int, int],
+                       template: ButtonTemplate,
+                       threshold: float
+                      ) -> Optional[Tuple[float, Optional[Tuple[int, int]]]]:
+        # (score, None) when no coarse peak got confirmed: the coarse score, so the search still counts for the tuner
+        img_x1, img_y1, img_x2, img_y2 = region_img
+        search_region = screen_img[img_y1:img_y2, img_x1:img_x2]
+        factor = PYRAMID_FACTOR
+        small_template = template.downscaled(factor)
+        small_frame = self._derived_frame(screen_img, f"pyr{factor}")
+        sx1, sy1 = img_x1 // factor, img_y1 // factor
+        small_region = small_frame[sy1:img_y2 // factor, sx1:img_x2 // factor]
+        small_h, small_w = small_template.shape[:2]
+        if (min(small_h, small_w) < PYRAMID_MIN_TEMPLATE_SIDE
+                or small_region.shape[0] < small_h or small_region.shape[1] < small_w):
+            return self._match_template(search_region, template.image)
+
+        try:
+             coarse = cv2.matchTemplate(small_region, small_template, cv2.TM_CCOEFF_NORMED)
+        except cv2.error as e:
+             logging.warning(f"cv2.matchTemplate failed on coarse level: {e}. Search shape: {small_region.shape}")
+             return None
+
+        # confirm the best few coarse peaks at full resolution in small rois
+        coarse_best = cv2.minMaxLoc(coarse)[1] # before _peaks blanks them
+        peaks = self._peaks(coarse, threshold - PYRAMID_COARSE_MARGIN, PYRAMID_CANDIDATES, small_w, small_h)
+        candidates = [((sx1 + cx) * factor - img_x1, (sy1 + cy) * factor - img_y1) for cx, cy in peaks]
+        return self._confirm_candidates(search_region, template, candidates, 2 * factor) or (coarse_best, None)
+
+    def _match_gray(self,
+                    screen_img: np.ndarray,
+                    region_img: Tuple[int, int, int, int],
+                    template: ButtonTemplate,
+                    button_key: str
+                   ) -> Optional[Tuple[float, Optional[Tuple[int, int]]]]:
+        # like _match_pyramid, (score, None) with the best gray score when nothing passed the prefilter
+        img_x1, img_y1, img_x2, img_y2 = region_img
+        search_region = screen_img[img_y1:img_y2, img_x1:img_x2]
+        gray_region = self._derived_frame(screen_img, "gray")[img_y1:img_y2, img_x1:img_x2]
+        prefilter_threshold = self.prefilter_thresholds.get(button_key, self.config.gray_prefilter_threshold)
+
+        started = time.perf_counter()
+        try:
+             result = cv2.matchTemplate(gray_region, template.gray(), cv2.TM_CCOEFF_NORMED)
+        except cv2.error as e:
+             logging.warning(f"cv2.matchTemplate failed on gray prefilter: {e}. Search shape: {gray_region.shape}")
+             return None
+        prefilter_best = cv2.minMaxLoc(result)[1]
+        candidates = self._peaks(result, prefilter_threshold, GRAY_CANDIDATES, template.width, template.height)
+        self.match_stats.add("prefilter", time.perf_counter() - started, len(candidates))
+
+        # colour confirmation keeps the precision of the plain bgr match
+        if not candidates: return prefilter_best, None
+        started = time.perf_counter()
+        match = self._confirm_candidates(search_region, template, candidates, 1)
+        self.match_stats.add("confirm", time.perf_counter() - started, len(candidates))
+        return match or (prefilter_best, None)
+
+    def _match_tiles(self, region_img: Tuple[int, int, int, int], template_w: int, template_h: int) -> List[Tuple[int, int, int, int]]:
+        # one tile per monitor, cut into bands when there are more processes than monitors; a tile holds the
+        # match positions (template top left) on its monitor and reaches template size - 1 px further, so a
+        # button across a monitor edge is still matched, by exactly one tile
+        img_x1, img_y1, img_x2, img_y2 = region_img
+        end_x, end_y = img_x2 - template_w + 1, img_y2 - template_h + 1
+        areas = []
+        for m in self.monitors:
+            mx1, my1 = self.screen_coords_to_img_coords(m['left'], m['top'])
+            x1, y1 = max(img_x1, mx1), max(img_y1, my1)
+            x2, y2 = min(end_x, mx1 + m['width']), min(end_y, my1 + m['height'])
+            if x1 < x2 and y1 < y2: areas.append((x1, y1, x2, y2))
+        bands = max(1, -(-self.tile_pool.processes // max(1, len(areas))))
+        tiles = []
+        for x1, y1, x2, y2 in areas:
+            step = max(1, -(-(y2 - y1) // bands))
+            for band_y in range(y1, y2, step):
+                tiles.append((x1, band_y, x2 + template_w - 1, min(band_y + step, y2) + template_h - 1))
+        return tiles
+
+    def _match_tiled(self,
+                     screen_img: np.ndarray,
+                     region_img: Tuple[int, int, int, int],
+                     template: ButtonTemplate
+                    ) -> Optional[Tuple[float, Tuple[int, int]]]:
+        # best of the per-tile maxima, relative to the region like _match_template
+        results = self.tile_pool.match(screen_img.shape, self._match_tiles(region_img, template.width, template.height), template.image)
+        if not results: return None
+        max_val, (x, y) = max(results, key=lambda result: result[0])
+        return max_val, (x - region_img[0], y - region_img[1])
+
     def _detect_single_template(self,
                                 screen_img: np.ndarray,
-                                template_img: np.ndarray,
+                                template: ButtonTemplate,
                                 threshold: float,
-                                search_bbox_screen: Optional[Tuple[int, int, int, int]] = None
+                                search_bbox_screen: Optional[Tuple[int, int, int, int]] = None,
+                                mode: str = "full",
+                                button_key: str = "",
+                                record: bool = True # into the score histograms and best scores, off for off-scale probes
                                ) -> Optional[Tuple[float, Tuple[int, int]]]:
-        template_h, template_w = template_img.shape[:2]
+        template_h, template_w = template.height, template.width
 
-        search_region = screen_img
-        offset_x, offset_y = 0, 0
+        img_x1, img_y1, img_x2, img_y2 = 0, 0, screen_img.shape[1], screen_img.shape[0]
 
         if search_bbox_screen:
             img_x1, img_y1 = self.screen_coords_to_img_coords(search_bbox_screen[0], search_bbox_screen[1])
@@ -253,18 +2413,24 @@ class System:
             img_x2, img_y2 = min(screen_img.shape[1], img_x2), min(screen_img.shape[0], img_y2)
 
             if img_x1 >= img_x2 or img_y1 >= img_y2: return None
-            search_region = screen_img[img_y1:img_y2, img_x1:img_x2]
-            offset_x, offset_y = img_x1, img_y1
-            if search_region.shape[0] < template_h or search_region.shape[1] < template_w: return None
-
-        try:
-             result = cv2.matchTemplate(search_region, template_img, cv2.TM_CCOEFF_NORMED)
-        except cv2.error as e:
-             logging.warning(f"cv2.matchTemplate failed: {e}. Search shape: {search_region.shape}, Template shape: {template_img.shape}")
-             return None
+        if img_y2 - img_y1 < template_h or img_x2 - img_x1 < template_w: return None
+        offset_x, offset_y = img_x1, img_y1
+
+        with self.profiler.stage(f"detect {button_key} {template.filename}"):
+            if mode == "pyramid":
+                match = self._match_pyramid(screen_img, (img_x1, img_y1, img_x2, img_y2), template, threshold)
+            elif mode == "gray":
+                match = self._match_gray(screen_img, (img_x1, img_y1, img_x2, img_y2), template, button_key)
+            elif (self.tile_pool and self.tile_pool.holds(screen_img)
+                    and (img_x2 - img_x1) * (img_y2 - img_y1) >= TILE_MIN_AREA):
+                match = self._match_tiled(screen_img, (img_x1, img_y1, img_x2, img_y2), template)
+            else:
+                match = self._match_template(screen_img[img_y1:img_y2, img_x1:img_x2], template.image)
+        if match is None: return None
 
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        if max_val >= 60: logging.info(max_val)
+        max_val, max_loc = match
+        if record: self.score_histograms.add(button_key, template.filename, max_val, self.lane.best_scores)
+        if max_loc is None: return None # only a coarse score, nothing was confirmed
         if max_val >= threshold:
             center_x_img = offset_x + max_loc[0] + template_w // 2
             center_y_img = offset_y + max_loc[1] + template_h // 2
@@ -279,39 +2445,234 @@ class System:
                                    button_key: str,
                                    search_bbox_screen: Optional[Tuple[int, int, int, int]] = None
                                   ) -> Optional[Tuple[int, int]]:
-        templates = self.button_templates.get(button_key)
+        templates = self._templates(button_key)
         threshold = self.match_thresholds.get(button_key, DEFAULT_MATCH_THRESHOLD)
+        mode = self.matcher_modes.get(button_key, "full")
 
         if not templates:
             return None
 
-        best_match_score = -1.0
-        best_match_location = None
+        cached_location = self._detect_cached(screen_img, button_key, search_bbox_screen)
+        if cached_location:
+            return cached_location
+
+        match_results = [self._detect_single_template(screen_img, template, threshold, search_bbox_screen, mode, button_key)
+                         for template in templates]
+        return self._remember_best(button_key, match_results)
 
-        for i, template_img in enumerate(templates):
-            match_result = self._detect_single_template(screen_img, template_img, threshold, search_bbox_screen)
+    @staticmethod
+    def _best_match(match_results: List[Optional[Tuple[float, Tuple[int, int]]]]) -> Optional[Tuple[int, Tuple[int, int]]]:
+        best_match_score = -1.0
+        best_match = None
 
+        for variant, match_result in enumerate(match_results):
             if match_result:
                 score, location = match_result
                 if score > best_match_score:
                     best_match_score = score
-                    best_match_location = location
+                    best_match = variant, location
+        return best_match
 
-        if best_match_location:
-            return best_match_location
-        else:
+    def _remember_best(self, button_key: str, match_results: List[Optional[Tuple[float, Tuple[int, int]]]]) -> Optional[Tuple[int, int]]:
+        best_match = self._best_match(match_results)
+        if not best_match:
+            return None
+        variant, location = best_match
+        self.hit_cache.remember(button_key, location, variant)
+        return location
+
+    def _detect_cached(self,
+                       screen_img: np.ndarray,
+                       button_key: str,
+                       search_bbox_screen: Optional[Tuple[int, int, int, int]] = None
+                      ) -> Optional[Tuple[int, int]]:
+        # look around recent hits of this key first, with the variant that matched there first
+        entries = self.hit_cache.entries_for(button_key)
+        if not entries:
+            return None
+        templates = self._templates(button_key)
+        threshold = self.match_thresholds.get(button_key, DEFAULT_MATCH_THRESHOLD)
+        radius = self.hit_cache.radius
+        for (x, y), cached_variant in entries:
+            order = [cached_variant] + [i for i in range(len(templates)) if i != cached_variant]
+            for variant in order:
+                if variant >= len(templates): continue
+                template = templates[variant]
+                x1, y1 = x - template.width // 2 - radius, y - template.height // 2 - radius
+                bbox = (x1, y1, x1 + template.width + 2 * radius, y1 + template.height + 2 * radius)
+                if search_bbox_screen:
+                    bbox = (max(bbox[0], search_bbox_screen[0]), max(bbox[1], search_bbox_screen[1]),
+                            min(bbox[2], search_bbox_screen[2]), min(bbox[3], search_bbox_screen[3]))
+                match_result = self._detect_single_template(screen_img, template, threshold, bbox, button_key=button_key)
+                if match_result:
+                    self.hit_cache.count(hit=True)
+                    self.hit_cache.remember(button_key, match_result[1], variant)
+                    return match_result[1]
+        self.hit_cache.count(hit=False)
+        return None
+
+    def detect_first_button(self,
+                            screen_img: np.ndarray,
+                            button_keys: List[Tuple[str, Optional[Tuple[int, int, int, int]]]]
+                           ) -> Optional[Tuple[str, Tuple[int, int]]]:
+        # button_keys is (key, search_bbox_screen) in priority order; every template of every key is
+        # matched concurrently, but a key only wins if no key before it matched
+        if self.detection_pool is None:
+            for button_key, search_bbox_screen in button_keys:
+                location = self.detect_button_alternatives(screen_img, button_key, search_bbox_screen)
+                if location and not self._duplicate_click(screen_img, button_key, location): return button_key, location
             return None
 
+        # cheap neighbourhood probes first, then full searches only for keys that outrank the first probe hit
+        cached_hit = None
+        full_search_keys = []
+        for button_key, search_bbox_screen in button_keys:
+            location = self._detect_cached(screen_img, button_key, search_bbox_screen)
+            if location:
+                if self._duplicate_click(screen_img, button_key, location): continue # that's the button clicked just now
+                cached_hit = button_key, location
+                break
+            full_search_keys.append((button_key, search_bbox_screen))
+
+        jobs = []
+        for button_key, search_bbox_screen in full_search_keys:
+            threshold = self.match_thresholds.get(button_key, DEFAULT_MATCH_THRESHOLD)
+            mode = self.matcher_modes.get(button_key, "full")
+            futures = [self.detection_pool.submit(self._detect_single_template, screen_img, template, threshold, search_bbox_screen, mode, button_key)
+                       for template in self._templates(button_key)]
+            jobs.append((button_key, futures))
+        try:
+            for button_key, futures in jobs:
+                location = self._remember_best(button_key, [future.result() for future in futures])
+                if location and not self._duplicate_click(screen_img, button_key, location): return button_key, location
+            if cached_hit: self._duplicate_click(screen_img, *cached_hit) # its signature is the one clicked
+            return cached_hit
+        finally:
+            # a match that already runs can't be cancelled: it reads this frame's buffer and records its scores,
+            # so it has to be done before the next capture reuses the buffer
+            running = [future for _, futures in jobs for future in futures if not future.cancel()]
+            if running: wait_futures(running)
+
+
+    def _click_signature(self, screen_img: np.ndarray, button_key: str, location: Tuple[int, int]) -> np.ndarray:
+        templates = self._templates(button_key)
+        width, height = max(t.width for t in templates), max(t.height for t in templates)
+        x, y = self.screen_coords_to_img_coords(*location)
+        patch = screen_img[max(0, y - height):max(1, y + height), max(0, x - width):max(1, x + width)]
+        if patch.size == 0: patch = screen_img
+        small = cv2.resize(cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY), (CLICK_SIGNATURE_SIZE, CLICK_SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+        return small.astype(np.float32)
+
+    def _duplicate_click(self, screen_img: np.ndarray, button_key: str, location: Tuple[int, int]) -> bool:
+        # only called for matches, so the signature costs nothing while nothing is found
+        if self.click_index.cooldown <= 0: return False
+        signature = self._click_signature(screen_img, button_key, location)
+        now = self.clock.monotonic()
+        if self.click_index.is_duplicate(button_key, location, now, signature):
+            logging.info(f"{self._lane_tag()}Ignoring '{button_key}' at {location}, clicked there moments ago and nothing changed.")
+            if self.flight_recorder:
+                self.flight_recorder.event(now, "duplicate", lane=self.lane.index, key=button_key, x=location[0], y=location[1])
+            return True
+        self.lane.last_click_signature = signature
+        return False
+
+    def detect_changed_button(self,
+                              screen_img: np.ndarray,
+                              button_keys: List[Tuple[str, Optional[Tuple[int, int, int, int]]]]
+                             ) -> Optional[Tuple[str, Tuple[int, int]]]:
+        # like detect_first_button, but only where the frame changed since the last full scan of this state
+        regions = self.lane.change_detector.dirty_regions(screen_img, (self.lane.current_state, tuple(sorted(self.capture_area.items()))))
+        if regions is None:
+            return self.detect_first_button(screen_img, button_keys)
+        if not regions:
+            return None
+
+        restricted_keys = []
+        for button_key, search_bbox_screen in button_keys:
+            templates = self._templates(button_key)
+            margin_x = max((t.width for t in templates), default=0)
+            margin_y = max((t.height for t in templates), default=0)
+            for x1, y1, x2, y2 in regions:
+                sx1, sy1 = self.img_coords_to_screen_coords(x1 - margin_x, y1 - margin_y)
+                sx2, sy2 = self.img_coords_to_screen_coords(x2 + margin_x, y2 + margin_y)
+                if search_bbox_screen:
+                    sx1, sy1 = max(sx1, search_bbox_screen[0]), max(sy1, search_bbox_screen[1])
+                    sx2, sy2 = min(sx2, search_bbox_screen[2]), min(sy2, search_bbox_screen[3])
+                if sx1 < sx2 and sy1 < sy2:
+                    restricted_keys.append((button_key, (sx1, sy1, sx2, sy2)))
+        return self.detect_first_button(screen_img, restricted_keys)
 
     def get_vortex_bbox_screen(self) -> Optional[Tuple[int, int, int, int]]:
+        return self._window_rect("vortex")
+
+    def _window_rect(self, name: str) -> Optional[Tuple[int, int, int, int]]:
+        with self.profiler.stage(f"window rect {name} (get_vortex_bbox_screen)" if name == "vortex" else f"window rect {name}"):
+            return self._lookup_window_rect(name)
+
+    def _lookup_window_rect(self, name: str) -> Optional[Tuple[int, int, int, int]]:
+        if name == "browser" and self.lane.region:
+            return self.lane.region
+        # handles are cached, a window is only looked up again once its handle stops working
+        key = f"browser{self.lane.index}" if name == "browser" else name # "browser" is the current lane's window
+        hwnd = self.window_handles.get(key)
+        rect = None
+        if hwnd:
+            try:
+                rect = self.window_backend.get_window_rect(hwnd)
+            except Exception:
+                rect = None
+        if rect is None:
+            if self.window_events and key in self.missing_windows:
+                return None # it can't have appeared without a window event
+            try:
+                if name == "vortex":
+                    hwnd = self.window_backend.find_window(VORTEX_WINDOW_TITLE)
+                elif name == "browser":
+                    hwnd = self.lane.browser_hwnd
+                if not hwnd:
+                    self.missing_windows.add(key)
+                    return None
+                rect = self.window_backend.get_window_rect(hwnd)
+            except Exception as e:
+                logging.error(f"Error getting {name} window rect: {e}")
+                return None
+            if rect: self.window_handles[key] = hwnd
+            else: self.missing_windows.add(key)
+        return tuple(rect) if rect else None
+
+    def _window_rects(self) -> Dict[str, Optional[Tuple[int, int, int, int]]]:
+        rects = {}
+        if self.use_vortex_logic:
+            rects["vortex"] = self.get_vortex_bbox_screen()
+        for lane in self.lanes:
+            if lane.browser_hwnd and not lane.region:
+                with self._lane_scope(lane):
+                    rects[f"browser{lane.index}"] = self._window_rect("browser")
+        return rects
+
+    def _new_lane(self, index: int, **fields) -> ScanLane:
+        change_detector = FrameChangeDetector(CHANGE_TILE_SIZE, self.config.change_threshold, CHANGE_FULL_SCAN_EVERY)
+        return ScanLane(index, change_detector=change_detector, **fields)
+
+    @contextlib.contextmanager
+    def _lane_scope(self, lane: ScanLane):
+        # the state machine and "browser" window lookups work on self.lane
+        previous, self.lane = self.lane, lane
         try:
-            hwnd = USER32.FindWindowW(None, VORTEX_WINDOW_TITLE)
-            if hwnd == 0: return None
-            rect = win32gui.GetWindowRect(hwnd)
-            return rect
-        except Exception as e:
-            logging.error(f"Error getting Vortex window rect: {e}")
-            return None
+            yield lane
+        finally:
+            self.lane = previous
+
+    def session_metadata(self) -> dict:
+        windows = []
+        vortex_bbox = self.get_vortex_bbox_screen()
+        if vortex_bbox: windows.append({"title": VORTEX_WINDOW_TITLE, "rect": list(vortex_bbox)})
+        for lane in self.lanes:
+            if not lane.browser_hwnd: continue
+            browser_rect = self.window_backend.get_window_rect(lane.browser_hwnd)
+            if browser_rect: windows.append({"title": BROWSER_TITLES.get(self.browser), "rect": list(browser_rect)})
+        monitors = [{k: m[k] for k in ("device", "left", "top", "width", "height", "is_primary")} for m in self.monitors]
+        return {"monitors": monitors, "windows": windows}
 
     def img_coords_to_screen_coords(self, img_x: int, img_y: int) -> Tuple[int, int]:
         return img_x - self.offset_x, img_y - self.offset_y
@@ -320,236 +2681,495 @@ class System:
         return screen_x + self.offset_x, screen_y + self.offset_y
 
     def _prepare_browser(self) -> None:
-        commands = {
-            "chrome": r'start chrome --new-window about:blank',
-            "firefox": r'start firefox -new-window about:blank',
-            "edge": r'start msedge --new-window about:blank'
-        }
-        window_titles = {"chrome": "New Tab - Google Chrome", "firefox": "Mozilla Firefox", "edge": "New tab - Microsoft​ Edge"}
-        fallback_titles = {"chrome": "Google Chrome", "firefox": "Mozilla Firefox", "edge": "Microsoft Edge"}
-        
-        if self.browser not in commands: logging.warning(f"Browser '{self.browser}' not recognized."); return
+        if self.browser not in BROWSER_LAUNCH_COMMANDS: logging.warning(f"Browser '{self.browser}' not recognized."); return
         logging.info(f"Preparing browser: {self.browser}")
         try:
-            subprocess.Popen(commands[self.browser], shell=True); time.sleep(1.5)
-        except:
-            pass
+            self.window_backend.launch(BROWSER_LAUNCH_COMMANDS[self.browser])
+        except OSError as e:
+            logging.warning(f"Failed to launch '{self.browser}': {e}")
         self._find_browser_hwnd()
 
     def _find_browser_hwnd(self):
         window_titles = {"chrome": "New Tab - Google Chrome", "firefox": "Mozilla Firefox", "edge": "New tab - Microsoft​ Edge"}
-        fallback_titles = {"chrome": "Google Chrome", "firefox": "Mozilla Firefox", "edge": "Microsoft Edge"}
 
         try:
-            hwnd = USER32.FindWindowW(None, window_titles.get(self.browser))
-            if not hwnd: hwnd = USER32.FindWindowW(None, fallback_titles.get(self.browser))
+            hwnd = self.window_backend.find_window(window_titles.get(self.browser))
+            if not hwnd: hwnd = self.window_backend.find_window(BROWSER_TITLES.get(self.browser))
             if not hwnd:
-                class_names = {"chrome": "Chrome_WidgetWin_1", "firefox": "MozillaWindowClass", "edge": "Chrome_WidgetWin_1"}
-                hwnd = USER32.FindWindowW(class_names.get(self.browser), None)
+                hwnd = self.window_backend.find_window(class_name=BROWSER_CLASS_NAMES.get(self.browser))
 
             if hwnd and len(self.monitors) > 0:
                 primary_monitor = self.monitors[0]
                 x, y = primary_monitor['left'], primary_monitor['top']
-                win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, x, y, 0, 0, win32con.SWP_NOSIZE | win32con.SWP_SHOWWINDOW)
-            if hwnd: self.browser_hwnd = hwnd
+                self.window_backend.move_window(hwnd, x, y)
+            if hwnd:
+                self.lane.browser_hwnd = hwnd
+                self.window_handles[f"browser{self.lane.index}"] = hwnd
         except Exception as e: logging.error(f"Failed to prepare browser '{self.browser}': {e}")
 
+    def _browser_windows(self) -> List[int]:
+        # chrome and edge share their window class with every electron app (vortex too), so the title has to end in the browser's name
+        suffix = BROWSER_TITLES.get(self.browser)
+        handles = []
+        try:
+            vortex = self.window_backend.find_window(VORTEX_WINDOW_TITLE)
+            for hwnd in self.window_backend.find_windows(class_name=BROWSER_CLASS_NAMES.get(self.browser)):
+                title = self.window_backend.get_window_title(hwnd).replace("\u200b", "") # edge puts a zero width space in its name
+                if hwnd != vortex and title.endswith(suffix): handles.append(hwnd)
+        except Exception as e: logging.error(f"Failed to list '{self.browser}' windows: {e}")
+        return handles
+
+    def _prepare_lanes(self, count: int, regions: List[Tuple[int, int, int, int]]) -> None:
+        now = self.clock.monotonic()
+        if regions:
+            handles = self._browser_windows() if self.browser else []
+            # fixed regions, the browser window under each one is only used for focus and closing tabs
+            self.lanes = [self._new_lane(i, state_transition_time=now, region=region) for i, region in enumerate(regions)]
+            try:
+                rects = [(hwnd, self.window_backend.get_window_rect(hwnd)) for hwnd in handles]
+            except Exception as e: # pywintypes.error when a window closed in between
+                logging.warning(f"Failed to get '{self.browser}' window rects for the lanes: {e}")
+                rects = []
+            for lane in self.lanes:
+                cx, cy = (lane.region[0] + lane.region[2]) // 2, (lane.region[1] + lane.region[3]) // 2
+                lane.browser_hwnd = next((hwnd for hwnd, r in rects if r and r[0] <= cx < r[2] and r[1] <= cy < r[3]), None)
+        else:
+            if not self.browser:
+                logging.warning("--lanes needs --browser (or --lane-region), running a single lane.")
+                return
+            for _ in range(count - 1): # _prepare_browser opened the first one
+                try:
+                    self.window_backend.launch(BROWSER_LAUNCH_COMMANDS[self.browser])
+                except OSError as e:
+                    logging.warning(f"Failed to launch '{self.browser}' for a lane: {e}")
+            handles = self._browser_windows()[:count] # newest windows are on top of the z-order
+            if len(handles) < count:
+                logging.warning(f"Found {len(handles)} '{self.browser}' windows for {count} lanes.")
+            if len(handles) < 2: return
+            # side by side on the primary monitor, so every lane's page is visible to the shared capture
+            monitor = self.monitors[0]
+            width = monitor['width'] // len(handles)
+            self.lanes = []
+            for i, hwnd in enumerate(handles):
+                self.window_backend.move_window(hwnd, monitor['left'] + i * width, monitor['top'], width, monitor['height'])
+                self.lanes.append(self._new_lane(i, state_transition_time=now, browser_hwnd=hwnd))
+        self.lane = self.lanes[0]
+        self.window_handles = {key: hwnd for key, hwnd in self.window_handles.items() if not key.startswith("browser")}
+        logging.info(f"Running {len(self.lanes)} lanes: {[(lane.browser_hwnd, lane.region) for lane in self.lanes]}")
+
 
     def _prepare_vortex(self) -> None:
         if len(self.monitors) <= 1: logging.info("Single monitor, skipping Vortex positioning."); return
         logging.info("Attempting to position Vortex window...")
         try:
-            hwnd = USER32.FindWindowW(None, VORTEX_WINDOW_TITLE)
+            hwnd = self.window_backend.find_window(VORTEX_WINDOW_TITLE)
             if hwnd == 0: logging.warning(f"Vortex window ('{VORTEX_WINDOW_TITLE}') not found for positioning."); return
             target_monitor = self.monitors[1] if len(self.monitors) > 1 else self.monitors[0]
             x, y = target_monitor['left'] + 50, target_monitor['top'] + 50
-            win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, x, y, 0, 0, win32con.SWP_NOSIZE | win32con.SWP_SHOWWINDOW)
+            self.window_backend.move_window(hwnd, x, y)
             logging.info(f"Positioned Vortex window (HWND: {hwnd}) on monitor: {target_monitor.get('device', 'Unknown')}")
         except Exception as e: logging.error(f"Failed to position Vortex window: {e}")
 
 
-    def _transition_state(self, next_state: ScanState):
-        if self.current_state != next_state:
-            logging.info(f"Transitioning from {self.current_state.name} to {next_state.name}")
-            self.current_state = next_state
-            self.state_transition_time = time.monotonic()
+    def _lane_tag(self) -> str:
+        return f"[lane {self.lane.index}] " if len(self.lanes) > 1 else ""
 
+    def _transition_state(self, next_state: ScanState):
+        if self.lane.current_state != next_state:
+            logging.info(f"{self._lane_tag()}Transitioning from {self.lane.current_state.name} to {next_state.name}")
+            now = self.clock.monotonic()
+            if self.flight_recorder:
+                self.flight_recorder.event(now, "transition", lane=self.lane.index, source=self.lane.current_state.name, target=next_state.name)
+            self.metrics.record_dwell(self.lane.current_state, now - self.lane.state_transition_time)
+            if self.scheduler and self.lane.current_state in self.state_plans and next_state != ScanState.INIT:
+                latency = now - self.lane.state_transition_time
+                self.scheduler.record_hit(self.lane.current_state, latency)
+                if self.lane.settling:
+                    self.scheduler.settle_feedback(latency)
+                    self.lane.settling = False
+            self.lane.current_state = next_state
+            self.lane.state_transition_time = now
+            self.lane.change_detector.reset()
+            self.lane.best_scores = {}
+            self.lane.burst_until = now + EVENT_BURST
+            if self.vortex_owner is self.lane and next_state not in VORTEX_OWNER_STATES:
+                self.vortex_owner = None
+            if next_state == ScanState.PROCESS_COMPLETE and not self.download_watcher: # else counted once the download shows up
+                self.metrics.record_cycle(self.lane.state_transition_time)
+
+
+    def _next_scan_delay(self, base_interval: float) -> float:
+        if self.window_events and self.clock.monotonic() > self.lane.burst_until:
+            base_interval = max(base_interval, EVENT_POLL_INTERVAL) # nothing happened lately, the events will wake us
+        if self.scheduler:
+            elapsed = self.clock.monotonic() - self.lane.state_transition_time
+            return self.scheduler.next_delay(self.lane.current_state, elapsed, base_interval)
+        return base_interval
 
     def run_state_machine(self) -> None:
-        now = time.monotonic()
-        elapsed_state_time = now - self.state_transition_time
-
-        timeout = None
-        if self.current_state == ScanState.WAIT_FOR_VORTEX_OR_CONTINUE: timeout = WAIT_TIMEOUT_VORTEX
-        elif self.current_state == ScanState.WAIT_FOR_WEB: timeout = WAIT_TIMEOUT_WEB
-        elif self.current_state == ScanState.WAIT_FOR_CLICK_HERE: timeout = WAIT_TIMEOUT_CLICK_HERE
-
-        if timeout is not None and elapsed_state_time > timeout:
-            logging.warning(f"Timeout in state {self.current_state.name}. Resetting.")
-            self._transition_state(ScanState.INIT)
+        delay = self._step()
+        self._run_pending_calibrations()
+        if delay <= 0: return
+        if self.window_events and self.lane.current_state in self.state_plans: # only waits for a button end early
+            self._wait_for_window_event(delay)
+        else:
+            self.clock.sleep(delay)
+        if self.capture_thread: self.capture_thread.invalidate()
+
+    def _window_event_relevant(self, event: WindowEvent) -> bool:
+        known = set(self.window_handles.values()) | {lane.browser_hwnd for lane in self.lanes if lane.browser_hwnd}
+        return event.hwnd in known or any(title in event.title for title in (VORTEX_WINDOW_TITLE, *BROWSER_TITLES.values()))
+
+    def _wait_for_window_event(self, timeout: float) -> bool:
+        # sleeps up to timeout, returns True as soon as Vortex or a browser window changed
+        deadline = self.clock.monotonic() + timeout
+        while True:
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0: return False
+            events = [event for event in self.window_events.wait(remaining) if self._window_event_relevant(event)]
+            if events:
+                now = self.clock.monotonic()
+                logging.info(f"Woken by window events: {', '.join(f'{e.kind} {e.title!r}' for e in events)}")
+                self.event_wakeups += 1
+                self.missing_windows.clear()
+                for lane in self.lanes: lane.burst_until = now + EVENT_BURST
+                return True
+
+    def run_lanes(self) -> None:
+        # one tick of every lane that is due; the lanes that scan this tick share a single capture
+        now = self.clock.monotonic()
+        due = [lane for lane in self.lanes if lane.due <= now]
+        if not due:
+            wait = min(lane.due for lane in self.lanes) - now
+            if not self.window_events:
+                self.clock.sleep(wait)
+            elif self._wait_for_window_event(wait):
+                for lane in self.lanes:
+                    if lane.current_state in self.state_plans: lane.due = self.clock.monotonic()
+            if self.capture_thread: self.capture_thread.invalidate()
             return
-
-        screen_img = None
-        capture_needed_states = [
-             ScanState.WAIT_FOR_VORTEX_OR_CONTINUE,
-             ScanState.WAIT_FOR_WEB,
-             ScanState.WAIT_FOR_CLICK_HERE
-        ]
-        if self.current_state in capture_needed_states:
-             screen_img = self.capture_screen()
-             if screen_img is None:
-                 logging.error("Failed to capture screen.")
-                 time.sleep(1)
-                 return
-
-        if self.current_state == ScanState.INIT:
-            logging.info("Starting scan cycle...")
+        areas = []
+        for lane in due:
+            plan = self.state_plans.get(lane.current_state)
+            if plan:
+                with self._lane_scope(lane):
+                    areas.append(self._scoped_capture_area(plan.capture_windows))
+        frame = None
+        if areas:
+            started = time.perf_counter()
+            frame = self.capture_screen(self._union_area(areas))
+            self.metrics.record_latency("capture", time.perf_counter() - started)
+        for lane in due:
+            with self._lane_scope(lane):
+                delay = self._step(frame)
+            lane.due = self.clock.monotonic() + delay
+        self._run_pending_calibrations()
+
+    def _run_pending_calibrations(self) -> None:
+        for lane in self.lanes:
+            if lane.calibration_plan is None: continue
+            plan, lane.calibration_plan = lane.calibration_plan, None
+            with self._lane_scope(lane):
+                self._calibrate_scales(plan)
+
+    def _union_area(self, areas: List[dict]) -> dict:
+        if len(areas) == 1: return areas[0]
+        if any(area is self.desktop_area for area in areas): return self.desktop_area
+        left, top = min(a["left"] for a in areas), min(a["top"] for a in areas)
+        right, bottom = max(a["left"] + a["width"] for a in areas), max(a["top"] + a["height"] for a in areas)
+        return {"top": top, "left": left, "width": right - left, "height": bottom - top, "mon": 0}
+
+    def _step(self, shared_frame: Optional[np.ndarray] = None) -> float:
+        # advances the current lane by one step, returns how long it wants to wait before the next one
+        now = self.clock.monotonic()
+        elapsed_state_time = now - self.lane.state_transition_time
+        plan = self.state_plans.get(self.lane.current_state)
+        self.metrics.maybe_flush(self.run_stats)
+
+        if plan and elapsed_state_time > plan.timeout:
+            best = ", ".join(f"{rule.button_key} {self.lane.best_scores[rule.button_key]:.3f}/{self.match_thresholds.get(rule.button_key, DEFAULT_MATCH_THRESHOLD)}"
+                             for rule in plan.rules if rule.button_key in self.lane.best_scores)
+            logging.warning(f"{self._lane_tag()}Timeout in state {self.lane.current_state.name}. Resetting. Best scores: {best or 'none'}")
+            if self.flight_recorder: self.flight_recorder.dump(now, f"timeout {self.lane.current_state.name}")
+            # not right away: calibration captures on its own, replacing the frame and offsets other lanes still match against
+            if self.config.scale_calibration: self.lane.calibration_plan = plan
+            self.metrics.record_timeout(self.lane.current_state)
+            if self.scheduler:
+                self.scheduler.record_timeout(self.lane.current_state)
+                if self.lane.settling:
+                    self.scheduler.settle_feedback(None)
+                    self.lane.settling = False
+            self._transition_state(ScanState.INIT)
+            return 0.0
+
+        if self.lane.current_state == ScanState.INIT:
+            if self.use_vortex_logic and self.vortex_owner not in (None, self.lane):
+                return self.config.scan_interval_vortex # another lane is busy with vortex
+            logging.info(f"{self._lane_tag()}Starting scan cycle...")
+            self.lane.web_clicked_at = None
+            self.lane.download_retries = 0
             if not self.use_vortex_logic:
                 self._transition_state(ScanState.WAIT_FOR_WEB)
             else:
+                self.vortex_owner = self.lane
                 self._transition_state(ScanState.WAIT_FOR_VORTEX_OR_CONTINUE)
-            time.sleep(0.1)
-
-        elif self.current_state == ScanState.WAIT_FOR_VORTEX_OR_CONTINUE:
-            if screen_img is None: return
-
-            understood_loc = self.detect_button_alternatives(screen_img, "understood") # not sure
-            if understood_loc:
-                logging.info(f"'Understood' button found at {understood_loc}.")
-                self.last_click_location = understood_loc
-                self._transition_state(ScanState.CLICK_UNDERSTOOD)
-                return
+            return 0.0 if self.scheduler else 0.1
 
-            staging_loc = self.detect_button_alternatives(screen_img, "staging") # not sure 
-            if staging_loc:
-                logging.info(f"'Staging' button found at {staging_loc}.")
-                self.last_click_location = staging_loc
-                self._transition_state(ScanState.CLICK_STAGING)
-                return
-
-            continue_loc = self.detect_button_alternatives(screen_img, "vortex_cont")
-            if continue_loc:
-                logging.info(f"Vortex 'Continue' button found at {continue_loc}.")
-                self.last_click_location = continue_loc
-                self._transition_state(ScanState.CLICK_CONTINUE)
-                return
-
-            vortex_bbox = self.get_vortex_bbox_screen() if self.use_vortex_logic else None
-            vortex_dl_loc = self.detect_button_alternatives(screen_img, "vortex_dl", search_bbox_screen=vortex_bbox)
-            if vortex_dl_loc:
-                logging.info(f"Vortex 'Download' button found at {vortex_dl_loc}.")
-                if vortex_dl_loc:
-                    if self.browser_hwnd and not self.browser_closed: #try to close current browser tab just before clicking download in vertex (or vortex icr)    
-                        try:
-                            self._find_browser_hwnd()
-                            win32gui.ShowWindow(self.browser_hwnd, win32con.SW_RESTORE)
-                            win32api.keybd_event(win32con.VK_MENU,             0, 0, 0)
-                            time.sleep(0.2)
-                            win32gui.SetForegroundWindow(self.browser_hwnd)
-                            win32api.keybd_event(win32con.VK_MENU,             0, win32con.KEYEVENTF_KEYUP, 0)
-                            
-
-                            time.sleep(0.05)
-                            win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)
-                            win32api.keybd_event(ord('W'),             0, 0, 0)
-                            time.sleep(0.05)
-                            win32api.keybd_event(ord('W'),             0, win32con.KEYEVENTF_KEYUP, 0)
-                            win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
-
-                            self.browser_closed = True
-                        except:
-                            pass
-
-                self.last_click_location = vortex_dl_loc
-                self._transition_state(ScanState.CLICK_VORTEX)
-                return
+        elif plan:
+            if self.download_watcher and self.lane.current_state == ScanState.WAIT_FOR_CLICK_HERE and self._download_started():
+                logging.info(f"{self._lane_tag()}Download already started, 'Click Here' not needed.")
+                self.lane.download_confirmed = True
+                self._transition_state(ScanState.PROCESS_COMPLETE)
+                return 0.0
 
-            time.sleep(SCAN_INTERVAL_VORTEX)
-
-
-        elif self.current_state == ScanState.WAIT_FOR_WEB:
-            if screen_img is None: return
-
-            understood_loc = self.detect_button_alternatives(screen_img, "understood") #not sure at all
-            if understood_loc:
-                logging.info(f"'Understood' button found at {understood_loc}.")
-                self.last_click_location = understood_loc
-                self._transition_state(ScanState.CLICK_UNDERSTOOD)
-                return
+            if shared_frame is not None:
+                screen_img = shared_frame
+            else:
+                started = time.perf_counter()
+                screen_img = self.capture_screen(self._scoped_capture_area(plan.capture_windows))
+                self.metrics.record_latency("capture", time.perf_counter() - started)
+            self.hit_cache.observe_windows(self._window_rects())
+            self._refresh_template_scales()
+            if screen_img is None:
+                logging.error("Failed to capture screen.")
+                return 1.0
+
+            # one preprocessing pass for all keys, then matching with early exit in priority order
+            started = time.perf_counter()
+            for form in plan.frame_forms:
+                self._derived_frame(screen_img, form)
+            found = self.detect_changed_button(screen_img, [
+                (rule.button_key, self._window_rect(rule.search_window) if rule.search_window else None)
+                for rule in plan.rules
+            ])
+            self.metrics.record_latency("match", time.perf_counter() - started)
+            if self.flight_recorder:
+                self.flight_recorder.event(now, "scan", lane=self.lane.index, state=self.lane.current_state.name, found=found and found[0],
+                                           best_scores={key: round(score, 3) for key, score in self.lane.best_scores.items()})
+            if found:
+                found_key, found_loc = found
+                rule = plan.rules_by_key[found_key]
+                if self.config.scale_calibration: self._verify_scale(self._scale_key(BUTTON_WINDOWS.get(found_key)))
+                logging.info(f"{self._lane_tag()}{rule.label} found at {found_loc}.")
+                if rule.on_hit: getattr(self, rule.on_hit)()
+                self.lane.last_click_location = found_loc
+                self.lane.last_click_key = found_key
+                self._transition_state(rule.next_state)
+                return 0.0
+
+            return self._next_scan_delay(plan.scan_interval)
+
+        elif self.lane.current_state in CLICK_TRANSITIONS:
+            if self.lane.last_click_location:
+                started = self.clock.perf_counter()
+                self._click(*self.lane.last_click_location)
+                self.metrics.record_latency("click", self.clock.perf_counter() - started)
+                self.click_index.remember(self.lane.last_click_key, self.lane.last_click_location, self.clock.monotonic(), self.lane.last_click_signature)
+                self.lane.last_click_signature = None
+                if self.lane.current_state in (ScanState.CLICK_WEB, ScanState.CLICK_NEXT):
+                    self.lane.web_clicked_at = self.clock.monotonic()
+                next_state, message = CLICK_TRANSITIONS[self.lane.current_state]
+                if message: logging.info(message)
+                self._transition_state(next_state)
+            else:
+                logging.error(f"State {self.lane.current_state.name} reached without a click location!")
+                self._transition_state(ScanState.INIT)
+            return 0.0
+
+        elif self.lane.current_state == ScanState.PROCESS_COMPLETE:
+            if self.download_watcher:
+                return self._await_download()
+            # first step starts the wait, the next one (after it) ends the cycle
+            if not self.lane.settle_started:
+                post_click_delay = self.scheduler.settle_delay if self.scheduler else self.config.post_click_delay
+                logging.info(f"{self._lane_tag()}Scan cycle potentially complete. Waiting {post_click_delay:.2f}s.")
+                self.lane.settle_started = True
+                started = self.clock.monotonic()
+                self._tidy_browser_tabs()
+                return max(0.0, post_click_delay - (self.clock.monotonic() - started))
+            self.lane.settle_started = False
+            self.lane.settling = self.scheduler is not None
+            self._transition_state(ScanState.INIT)
+        return 0.0
+
+    def _download_started(self) -> bool:
+        # downloads can't tell which lane started them: a lane claims the oldest one seen after its last page click
+        now = self.clock.monotonic()
+        for kind, _ in self.download_watcher.poll():
+            if kind == "started": self.download_events.append(now)
+        waiting = [lane.web_clicked_at for lane in self.lanes if lane.web_clicked_at is not None]
+        while self.download_events and (not waiting or self.download_events[0] < min(waiting)):
+            self.download_events.popleft()
+        since = self.lane.web_clicked_at
+        if since is None: return False
+        for i, started in enumerate(self.download_events):
+            if started >= since:
+                del self.download_events[i]
+                self.metrics.record_latency("download start", started - since)
+                self.lane.web_clicked_at = None
+                return True
+        return False
+
+    def _await_download(self) -> float:
+        # PROCESS_COMPLETE with a download watcher: next cycle as soon as the download shows up instead of
+        # after --post-click-delay, and the 'click here' click is retried when nothing shows up
+        if self.lane.download_confirmed or self._download_started():
+            logging.info(f"{self._lane_tag()}Download started.")
+            self.lane.download_confirmed = False
+            self.metrics.record_cycle(self.clock.monotonic())
+            self._tidy_browser_tabs()
+            self._transition_state(ScanState.INIT)
+            return 0.0
+        if self.clock.monotonic() - self.lane.state_transition_time < self.config.download_timeout:
+            return self.config.scan_interval_click_here
+        if self.lane.download_retries < self.config.download_retries:
+            self.lane.download_retries += 1
+            self.download_retries += 1
+            logging.warning(f"{self._lane_tag()}No download started after {self.config.download_timeout}s, retrying the click ({self.lane.download_retries}/{self.config.download_retries}).")
+            self._transition_state(ScanState.WAIT_FOR_CLICK_HERE)
+        else:
+            logging.warning(f"{self._lane_tag()}No download started after {self.config.download_timeout}s. Resetting.")
+            self.metrics.record_timeout(ScanState.PROCESS_COMPLETE)
+            self._transition_state(ScanState.INIT)
+        return 0.0
 
-            staging_loc = self.detect_button_alternatives(screen_img, "staging") #not sure
-            if staging_loc:
-                logging.info(f"'Staging' button found at {staging_loc}.")
-                self.last_click_location = staging_loc
-                self._transition_state(ScanState.CLICK_STAGING)
-                return
+    def _mark_browser_tab_open(self) -> None:
+        # only vortex opens a tab per mod, without it the tabs are the user's own
+        if self.use_vortex_logic and self.lane.browser_hwnd: self.tab_manager.opened(self.lane.browser_hwnd)
 
-            web_loc = self.detect_button_alternatives(screen_img, "web_dl")
-            if web_loc:
-                 logging.info(f"Web Download button found at {web_loc}.")
-                 self.last_click_location = web_loc
-                 self._transition_state(ScanState.CLICK_WEB)
-                 self.browser_closed = False
-                 return
-
-            time.sleep(SCAN_INTERVAL_WEB)
-
-
-        elif self.current_state == ScanState.WAIT_FOR_CLICK_HERE:
-             if screen_img is None: return
-
-             click_here_loc = self.detect_button_alternatives(screen_img, "click_here")
-             if click_here_loc:
-                 logging.info(f"'Click Here' button found at {click_here_loc}.")
-                 self.last_click_location = click_here_loc
-                 self._transition_state(ScanState.CLICK_NEXT)
-                 return
-
-             time.sleep(SCAN_INTERVAL_CLICK_HERE)
-
-
-        elif self.current_state in [ScanState.CLICK_VORTEX, ScanState.CLICK_CONTINUE,
-                                    ScanState.CLICK_WEB, ScanState.CLICK_NEXT,
-                                    ScanState.CLICK_UNDERSTOOD, ScanState.CLICK_STAGING]:
-            if self.last_click_location:
-                self._click(*self.last_click_location)
-                if self.current_state in [ScanState.CLICK_VORTEX, ScanState.CLICK_CONTINUE]:
-                    self._transition_state(ScanState.WAIT_FOR_WEB)
-                elif self.current_state == ScanState.CLICK_WEB:
-                    self._transition_state(ScanState.WAIT_FOR_CLICK_HERE)
-                elif self.current_state == ScanState.CLICK_NEXT:
-                     self._transition_state(ScanState.PROCESS_COMPLETE)
-                elif self.current_state == ScanState.CLICK_UNDERSTOOD: #yep, still not sure, never seen that
-                     logging.info("Clicked 'Understood', re-checking for primary buttons...")
-                     self._transition_state(ScanState.WAIT_FOR_VORTEX_OR_CONTINUE)
-
-                elif self.current_state == ScanState.CLICK_STAGING: #same
-                     logging.info("Clicked 'Staging', re-checking for primary buttons...")
-                     self._transition_state(ScanState.WAIT_FOR_VORTEX_OR_CONTINUE)
+    def _tidy_browser_tabs(self) -> None:
+        # runs while the cycle settles, the download is already going and nothing waits on input
+        if self.use_vortex_logic and self.lane.browser_hwnd: self.tab_manager.maybe_close(self.lane.browser_hwnd)
 
-            else:
-                logging.error(f"State {self.current_state.name} reached without a click location!")
-                self._transition_state(ScanState.INIT)
 
-        elif self.current_state == ScanState.PROCESS_COMPLETE:
-            logging.info(f"Scan cycle potentially complete. Waiting {POST_CLICK_DELAY}s.")
-            time.sleep(POST_CLICK_DELAY)
-            self._transition_state(ScanState.INIT)
+    def _close_tile_pool(self) -> None:
+        if self.tile_pool:
+            self._frame_buffer = None
+            self._derived_source = None
+            self.tile_pool.close()
 
+    def run_stats(self) -> dict:
+        return {
+            **self.metrics.summary(),
+            "hit_cache_hits": self.hit_cache.hits,
+            "hit_cache_misses": self.hit_cache.misses,
+            "hit_cache_invalidations": self.hit_cache.invalidations,
+            "change_frames": sum(lane.change_detector.frames for lane in self.lanes),
+            "change_skipped": sum(lane.change_detector.skipped for lane in self.lanes),
+            "change_partial": sum(lane.change_detector.partial for lane in self.lanes),
+            "change_skip_rate": round(sum(lane.change_detector.skipped for lane in self.lanes) / max(1, sum(lane.change_detector.frames for lane in self.lanes)), 3),
+            **self.tab_manager.summary(),
+            **({"downloads_started": self.download_watcher.started, "downloads_finished": self.download_watcher.finished,
+                "download_retries": self.download_retries} if self.download_watcher else {}),
+            "duplicate_clicks_suppressed": sum(self.click_index.suppressed.values()),
+            **({"duplicates_by_key": dict(self.click_index.suppressed)} if self.click_index.suppressed else {}),
+            **({"window_event_wakeups": self.event_wakeups} if self.window_events else {}),
+            **({"flight_recorder_dumps": self.flight_recorder.dumps, "flight_recorder_dropped": self.flight_recorder.dropped_dumps} if self.flight_recorder else {}),
+            **({"tile_tasks": self.tile_pool.tasks, "tile_frame_copies": self.tile_pool.copies} if self.tile_pool else {}),
+            **({"lanes": len(self.lanes), "lane_focus_changes": self.input_arbiter.focus_changes} if len(self.lanes) > 1 else {}),
+            **(self.scheduler.summary() if self.scheduler else {}),
+            **self.match_stats.summary(),
+        }
 
     def scan_continuously(self) -> None:
         logging.info("Starting continuous scan...")
+        wall_start = time.perf_counter()
         try:
+            step = self.run_lanes if len(self.lanes) > 1 else self.run_state_machine
             while True:
-                self.run_state_machine()
+                step()
         except KeyboardInterrupt:
             logging.info("Scan interrupted by user (KeyboardInterrupt).")
+        except ReplayExhausted as e:
+            logging.info(str(e))
         except Exception as e:
             logging.exception(f"An unexpected error occurred during scan: {e}")
+            if self.flight_recorder: self.flight_recorder.dump(self.clock.monotonic(), f"exception {type(e).__name__}: {e}")
         finally:
-            if hasattr(self, 'screen_capturer') and self.screen_capturer:
-                self.screen_capturer.close()
+            self.wall_time = time.perf_counter() - wall_start
+            if self.detection_pool:
+                self.detection_pool.shutdown(wait=False, cancel_futures=True)
+            if self.capture_thread:
+                self.capture_thread.stop()
+            if self.window_events:
+                self.window_events.close()
+            if self.flight_recorder:
+                self.flight_recorder.close()
+            if hasattr(self, 'capture_backend') and self.capture_backend:
+                self.capture_backend.close()
             logging.info("Screen capturer closed. Exiting.")
+            self.metrics.flush(self.run_stats())
+            self.metrics.log_summary(self.wall_time)
+            self._save_score_histograms()
+            self._close_tile_pool()
+            if self.profiler.enabled:
+                logging.warning("Per-stage profile:\n" + "\n".join(self.profiler.report()))
+
+
+def run_benchmark(config: ScanConfig, frames: int, background_dir: Optional[str], verbose: bool) -> dict:
+    # precision/recall/localization error/latency of detect_button_alternatives over synthetic screens
+    backgrounds = []
+    if background_dir:
+        for name in sorted(os.listdir(background_dir)):
+            if os.path.splitext(name)[1].lower() in (".png", ".jpg", ".jpeg", ".bmp"):
+                img = cv2.imread(os.path.join(background_dir, name), cv2.IMREAD_COLOR)
+                if img is not None: backgrounds.append(img)
+        logging.warning(f"Benchmark backgrounds: {len(backgrounds)} images from {background_dir}")
+    report = {"seed": BENCHMARK_SEED, "frames": frames, "thresholds": dict(config.match_thresholds),
+              "matchers": dict(config.matcher_modes), "resolutions": {}}
+    lines = [f"{'resolution':<11} {'key':<12} {'tp':>5} {'fp':>5} {'fn':>5} {'precision':>9} {'recall':>7} {'loc err px':>10} {'ms/frame p50':>12} {'p95':>7}"]
+    screens = SyntheticCaptureBackend({}, backgrounds)
+    for width, height in BENCHMARK_RESOLUTIONS:
+        monitor = {"device": "benchmark", "left": 0, "top": 0, "width": width, "height": height, "is_primary": True}
+        clock = VirtualClock()
+        agent = System(verbose=verbose, config=config, clock=clock, input_backend=RecordingInputBackend(clock),
+                       window_backend=ReplayWindowBackend({"monitors": [monitor]}),
+                       capture_backend=screens)
+        if not screens.templates:
+            screens.set_templates({key: [t.image for t in templates] for key, templates in agent.button_templates.items()}, agent.match_thresholds)
+        counts = {key: {"tp": 0, "fp": 0, "fn": 0, "errors": []} for key in agent.button_templates}
+        latencies = []
+        for _ in range(frames):
+            truths = {key: (center, size) for key, center, size in screens.next_frame(width, height)}
+            img = agent.capture_screen()
+            agent.hit_cache.entries.clear() # screens are unrelated, a hit on the last one says nothing
+            started = time.perf_counter()
+            found = {key: agent.detect_button_alternatives(img, key) for key in counts}
+            latencies.append(time.perf_counter() - started)
+            for key, location in found.items():
+                truth = truths.get(key)
+                if truth and location:
+                    (tx, ty), (tw, th) = truth
+                    error = ((location[0] - tx) ** 2 + (location[1] - ty) ** 2) ** 0.5
+                    if error <= min(tw, th) / 2:
+                        counts[key]["tp"] += 1
+                        counts[key]["errors"].append(error)
+                        continue
+                if location: counts[key]["fp"] += 1
+                if truth: counts[key]["fn"] += 1
+        if agent.detection_pool: agent.detection_pool.shutdown()
+        agent._close_tile_pool()
+
+        latencies.sort()
+        latency = {"p50": round(RunMetrics._percentile(latencies, 0.5) * 1000, 2), "p95": round(RunMetrics._percentile(latencies, 0.95) * 1000, 2),
+                   "mean": round(sum(latencies) / len(latencies) * 1000, 2)}
+        resolution = f"{width}x{height}"
+        rows = dict(counts, all={"tp": sum(c["tp"] for c in counts.values()), "fp": sum(c["fp"] for c in counts.values()),
+                                 "fn": sum(c["fn"] for c in counts.values()), "errors": [e for c in counts.values() for e in c["errors"]]})
+        result = {"latency_ms": latency, "keys": {}}
+        for key, c in rows.items():
+            stats = {"tp": c["tp"], "fp": c["fp"], "fn": c["fn"],
+                     "precision": round(c["tp"] / (c["tp"] + c["fp"]), 3) if c["tp"] + c["fp"] else None,
+                     "recall": round(c["tp"] / (c["tp"] + c["fn"]), 3) if c["tp"] + c["fn"] else None,
+                     "loc_error_mean": round(sum(c["errors"]) / len(c["errors"]), 2) if c["errors"] else None,
+                     "loc_error_max": round(max(c["errors"]), 2) if c["errors"] else None}
+            if key == "all": result.update(stats)
+            else: result["keys"][key] = stats
+            lines.append(f"{resolution:<11} {key:<12} {c['tp']:>5} {c['fp']:>5} {c['fn']:>5} {str(stats['precision']):>9} {str(stats['recall']):>7} "
+                         f"{str(stats['loc_error_mean']):>10} {latency['p50'] if key == 'all' else '':>12} {latency['p95'] if key == 'all' else '':>7}")
+        report["resolutions"][resolution] = result
+    logging.warning("Detector benchmark:\n" + "\n".join(lines))
+    return report
 
 
 @click.command()
@@ -570,38 +3190,159 @@ class System:
 @click.option('--scan-interval-web', type=float, default=SCAN_INTERVAL_WEB, help='Scan interval for web actions.')
 @click.option('--scan-interval-click-here', type=float, default=SCAN_INTERVAL_CLICK_HERE, help='Scan interval for "click here" actions.')
 @click.option('--post-click-delay', type=float, default=POST_CLICK_DELAY, help='Delay after final click before restarting scan.')
+@click.option('--matcher', 'matchers', multiple=True, metavar='KEY=MODE', help=f'Matcher for a button key ({"/".join(MATCHER_CHOICES)}), "all=MODE" sets every key. Repeatable.')
+@click.option('--gray-prefilter-threshold', type=float, default=GRAY_PREFILTER_THRESHOLD, help='Grayscale score a candidate needs before the colour check (gray matcher).')
+@click.option('--detect-workers', type=int, default=DETECTION_WORKERS, help='Threads used to match templates in parallel (1 = serial).')
+@click.option('--match-processes', type=int, default=MATCH_PROCESSES, help='Worker processes that match per-monitor tiles of big frames from shared memory (full matcher, 0 = off).')
+@click.option('--hit-cache-size', type=int, default=HIT_CACHE_SIZE, help='Recent hit locations per button searched first (0 disables the cache).')
+@click.option('--click-cooldown', type=float, default=CLICK_COOLDOWN, help='Seconds a button is ignored at the spot it was just clicked while the screen there is unchanged (0 disables).')
+@click.option('--full-desktop-capture', is_flag=True, default=False, help='Always capture the whole desktop instead of only the windows a state needs.')
+@click.option('--change-threshold', type=float, default=CHANGE_THRESHOLD, help='Mean colour change (0-255) of a screen tile that triggers re-matching it, 0 disables change detection.')
+@click.option('--capture-thread', is_flag=True, default=False, help='Capture in a background thread so matching never waits for a screen grab.')
+@click.option('--adaptive-scan', is_flag=True, default=False, help='Learn when buttons usually appear and poll around that time instead of at fixed intervals.')
+@click.option('--window-events', is_flag=True, default=False, help='Scan right away when Vortex or a browser window appears, changes its title or comes to the front, and poll only slowly otherwise.')
+@click.option('--flight-recorder', 'flight_recorder_dir', type=click.Path(file_okay=False), default=None, help='Keep the last frames, scores and state changes in memory and write them to a zip in this folder on every timeout or crash.')
+@click.option('--metrics-file', type=click.Path(dir_okay=False), default=None, help='Periodically write run metrics here: Prometheus text format for *.prom, JSON lines otherwise.')
+@click.option('--metrics-interval', type=float, default=METRICS_INTERVAL, help='Seconds between metrics file writes.')
+@click.option('--profile', is_flag=True, default=False, help='Time every stage of the scan loop and print a per-stage breakdown on exit.')
+@click.option('--profile-dump', type=click.Path(dir_okay=False), default=None, help='Also run cProfile and dump the stats here (pstats format, e.g. for snakeviz or flameprof).')
+@click.option('--download-dir', 'download_dirs', multiple=True, type=click.Path(exists=True, file_okay=False), help='Watch this folder for new downloads and start the next cycle as soon as one shows up. Repeatable.')
+@click.option('--download-timeout', type=float, default=DOWNLOAD_CONFIRM_TIMEOUT, help='Seconds after the last web click to wait for a download before retrying (with --download-dir).')
+@click.option('--download-retries', type=int, default=DOWNLOAD_RETRIES, help='How often the "click here" click is retried when no download shows up (with --download-dir).')
+@click.option('--tab-budget', type=int, default=TAB_BUDGET, help='Nexus tabs a browser window may collect before they are closed in one batch (1 = close after every mod).')
+@click.option('--browser-memory-budget', type=float, default=BROWSER_MEMORY_BUDGET_MB, help='Close the collected tabs early once the browser uses this many MB (needs psutil, 0 disables).')
+@click.option('--no-scale-calibration', is_flag=True, default=False, help='Never search buttons at other scales after a timeout (display scaling/browser zoom).')
+@click.option('--click-method', type=click.Choice(CLICK_METHODS), default=CLICK_METHOD, help='How clicks are sent: one SendInput batch, messages posted to the window, or the old cursor move with sleeps.')
+@click.option('--lanes', type=int, default=SCAN_LANES, help='Run this many download pipelines side by side, each in its own browser window (needs --browser).')
+@click.option('--lane-region', 'lane_regions', multiple=True, metavar='X1,Y1,X2,Y2', help='Screen rect of one lane\'s browser page, instead of opening and tiling windows. Repeatable, one lane each.')
+@click.option('--tune-thresholds', 'tune', is_flag=True, default=False, help=f'Propose per-button thresholds from the collected score histograms, write them to {ASSET_DIRECTORY}/{THRESHOLD_FILE} and exit.')
+@click.option('--benchmark', is_flag=True, default=False, help='Measure detector precision/recall/localization error/latency on synthetic screens and exit (headless).')
+@click.option('--benchmark-frames', type=int, default=BENCHMARK_FRAMES, help='Synthetic screens per benchmark resolution.')
+@click.option('--benchmark-backgrounds', type=click.Path(exists=True, file_okay=False), default=None, help='Draw the benchmark buttons onto crops of the screenshots in this folder (e.g. a --record session) instead of generated desktops.')
+@click.option('--benchmark-report', type=click.Path(dir_okay=False), default=None, help='Write the benchmark results to this JSON file.')
+@click.option('--record', 'record_dir', type=click.Path(file_okay=False), default=None, help='Record captured frames into a replay session directory.')
+@click.option('--replay', 'replay_dir', type=click.Path(exists=True, file_okay=False), default=None, help='Run headless against a recorded session instead of the live desktop.')
+@click.option('--replay-report', type=click.Path(dir_okay=False), default=None, help='Write replay stats and the clicks it produced to this JSON file.')
 
 def main(browser, vortex, verbose, force_primary, vortex_dl_match_threshold, vortex_cont_match_threshold,
          web_dl_match_threshold, click_here_match_threshold, understood_match_threshold,
          staging_match_threshold, wait_timeout_vortex, wait_timeout_web,
          wait_timeout_click_here, scan_interval_vortex, scan_interval_web,
-         scan_interval_click_here, post_click_delay):
-    global VORTEX_DL_MATCH_THRESHOLD, VORTEX_CONT_MATCH_THRESHOLD, WEB_DL_MATCH_THRESHOLD
-    global CLICK_HERE_MATCH_THRESHOLD, UNDERSTOOD_MATCH_THRESHOLD, STAGING_MATCH_THRESHOLD
-    global WAIT_TIMEOUT_VORTEX, WAIT_TIMEOUT_WEB, WAIT_TIMEOUT_CLICK_HERE
-    global SCAN_INTERVAL_VORTEX, SCAN_INTERVAL_WEB, SCAN_INTERVAL_CLICK_HERE
-    global POST_CLICK_DELAY
-
-    VORTEX_DL_MATCH_THRESHOLD = vortex_dl_match_threshold
-    VORTEX_CONT_MATCH_THRESHOLD = vortex_cont_match_threshold
-    WEB_DL_MATCH_THRESHOLD = web_dl_match_threshold
-    CLICK_HERE_MATCH_THRESHOLD = click_here_match_threshold
-    UNDERSTOOD_MATCH_THRESHOLD = understood_match_threshold
-    STAGING_MATCH_THRESHOLD = staging_match_threshold
-    WAIT_TIMEOUT_VORTEX = wait_timeout_vortex
-    WAIT_TIMEOUT_WEB = wait_timeout_web
-    WAIT_TIMEOUT_CLICK_HERE = wait_timeout_click_here
-    SCAN_INTERVAL_VORTEX = scan_interval_vortex
-    SCAN_INTERVAL_WEB = scan_interval_web
-    SCAN_INTERVAL_CLICK_HERE = scan_interval_click_here
-    POST_CLICK_DELAY = post_click_delay
+         scan_interval_click_here, post_click_delay, matchers, gray_prefilter_threshold, detect_workers, match_processes, hit_cache_size, click_cooldown, full_desktop_capture, change_threshold, capture_thread, adaptive_scan, window_events, flight_recorder_dir, metrics_file, metrics_interval, profile, profile_dump, download_dirs, download_timeout, download_retries, tab_budget, browser_memory_budget, no_scale_calibration, click_method, lanes, lane_regions, tune, benchmark, benchmark_frames, benchmark_backgrounds, benchmark_report, record_dir, replay_dir, replay_report):
+    config = ScanConfig(
+        match_thresholds={
+            "vortex_dl": vortex_dl_match_threshold,
+            "web_dl": web_dl_match_threshold,
+            "click_here": click_here_match_threshold,
+            "vortex_cont": vortex_cont_match_threshold,
+            "understood": understood_match_threshold,
+            "staging": staging_match_threshold,
+        },
+        wait_timeout_vortex=wait_timeout_vortex,
+        wait_timeout_web=wait_timeout_web,
+        wait_timeout_click_here=wait_timeout_click_here,
+        scan_interval_vortex=scan_interval_vortex,
+        scan_interval_web=scan_interval_web,
+        scan_interval_click_here=scan_interval_click_here,
+        post_click_delay=post_click_delay,
+        gray_prefilter_threshold=gray_prefilter_threshold,
+        # cProfile only sees the main thread, so the dump needs matching and capture to happen there
+        detection_workers=1 if profile_dump else detect_workers,
+        match_processes=0 if profile_dump else match_processes,
+        hit_cache_size=hit_cache_size,
+        click_cooldown=click_cooldown,
+        window_scoped_capture=not full_desktop_capture,
+        change_threshold=change_threshold,
+        capture_thread=capture_thread and not replay_dir and not profile_dump,
+        adaptive_scan=adaptive_scan,
+        metrics_interval=metrics_interval,
+        download_timeout=download_timeout,
+        download_retries=download_retries,
+        tab_budget=tab_budget,
+        browser_memory_budget_mb=browser_memory_budget,
+        scale_calibration=not no_scale_calibration,
+        click_method=click_method,
+    )
+    for matcher in matchers:
+        key, _, mode = matcher.partition("=")
+        if mode not in MATCHER_CHOICES or (key != "all" and key not in BUTTON_ASSETS):
+            raise click.BadParameter(f"expected KEY=MODE with KEY in {list(BUTTON_ASSETS)} or 'all' and MODE in {MATCHER_CHOICES}, got '{matcher}'", param_hint="--matcher")
+        for k in (BUTTON_ASSETS if key == "all" else [key]): config.matcher_modes[k] = mode
+    regions = []
+    for region in lane_regions:
+        try:
+            x1, y1, x2, y2 = (int(v) for v in region.split(","))
+        except ValueError:
+            raise click.BadParameter(f"expected X1,Y1,X2,Y2, got '{region}'", param_hint="--lane-region")
+        if x1 >= x2 or y1 >= y2:
+            raise click.BadParameter(f"empty region '{region}'", param_hint="--lane-region")
+        regions.append((x1, y1, x2, y2))
 
     log_level = logging.INFO if verbose else logging.WARNING
     logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    if capture_thread and replay_dir:
+        logging.warning("--capture-thread is ignored with --replay, replay has to stay deterministic.")
+    if browser_memory_budget > 0 and psutil is None:
+        logging.warning("--browser-memory-budget needs psutil (pip install psutil), only the tab budget is used.")
+
+    # thresholds given on the command line win over the tuned ones in THRESHOLD_FILE
+    context = click.get_current_context()
+    for key, threshold in load_thresholds().items():
+        if context.get_parameter_source(f"{key}_match_threshold") != click.core.ParameterSource.COMMANDLINE:
+            config.match_thresholds[key] = threshold
+    if tune:
+        try:
+            tune_thresholds(config.match_thresholds)
+        except (OSError, ValueError) as e:
+            logging.error(f"Threshold tuning failed: {e}")
+        return
+    if benchmark:
+        try:
+            report = run_benchmark(config, benchmark_frames, benchmark_backgrounds, verbose)
+        except (RuntimeError, FileNotFoundError, IOError) as e:
+            logging.error(f"Benchmark failed: {e}")
+            return
+        if benchmark_report:
+            with open(benchmark_report, "w") as f:
+                json.dump(report, f, indent=1)
+        return
+
+    backends = {}
+    if replay_dir:
+        clock = VirtualClock()
+        capture_backend = ReplayCaptureBackend(replay_dir, clock)
+        backends = dict(clock=clock, capture_backend=capture_backend,
+                        input_backend=RecordingInputBackend(clock, CLICK_METHOD_SLEEPS[click_method]),
+                        window_backend=ReplayWindowBackend(capture_backend.session))
+        if window_events:
+            backends["window_events"] = ScriptedWindowEventSource(clock, capture_backend.session.get("window_events"), capture_backend.start_time)
+    elif record_dir:
+        capture_backend = RecordingCaptureBackend(MssCaptureBackend(), record_dir, Clock())
+        backends = dict(capture_backend=capture_backend)
+        if window_events:
+            backends["window_events"] = RecordingWindowEventSource(WinEventSource(), capture_backend.clock, capture_backend.start_time)
+    elif window_events:
+        backends = dict(window_events=WinEventSource())
 
     try:
-        agent = System(browser=browser, vortex=vortex, verbose=verbose, force_primary=force_primary)
+        agent = System(browser=browser, vortex=vortex, verbose=verbose, force_primary=force_primary, config=config,
+                       metrics_file=metrics_file, profile=profile or bool(profile_dump), lanes=lanes, lane_regions=regions,
+                       download_dirs=list(download_dirs), flight_recorder_dir=flight_recorder_dir, **backends)
+        if record_dir and not replay_dir:
+            agent.capture_backend.metadata = agent.session_metadata()
+            if window_events: agent.capture_backend.metadata["window_events"] = agent.window_events.recorded
+        profiler = cProfile.Profile() if profile_dump else None
+        if profiler:
+            logging.warning("Profiling: matching and capture run serially on the main thread, so cProfile sees them.")
+            profiler.enable()
         agent.scan_continuously()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_dump)
+            logging.warning(f"cProfile stats written to {profile_dump}")
+        if replay_dir and replay_report:
+            with open(replay_report, "w") as f:
+                json.dump(dict(agent.run_stats(), wall_time=agent.wall_time, clicks=agent.input_backend.events), f, indent=1)
     except (RuntimeError, FileNotFoundError, IOError) as e:
         logging.error(f"Initialization or runtime error: {e}")
     except Exception as e:
@@ -609,4 +3350,5 @@ def main(browser, vortex, verbose, force_primary, vortex_dl_match_threshold, vor
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # the frozen exe is also what spawns the tile workers, they must not run the cli
     main()
\ No newline at end of file
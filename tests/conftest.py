@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# main.py lives in the repo root, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import ASSET_DIRECTORY, BUTTON_ASSETS, SESSION_FILE, ScanConfig
+
+SCREEN = {"device": "replay0", "left": 0, "top": 0, "width": 800, "height": 600, "is_primary": True}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # runs write caches and histograms next to the assets, so they get a copy of their own
+    shutil.copytree(os.path.join(ROOT, ASSET_DIRECTORY), tmp_path / ASSET_DIRECTORY,
+                    ignore=shutil.ignore_patterns("*.bin", "*.json"))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def button(key):
+    return cv2.imread(os.path.join(ROOT, ASSET_DIRECTORY, BUTTON_ASSETS[key][0]), cv2.IMREAD_COLOR)
+
+
+def screen(buttons=()):
+    # flat desktop with the first asset of each (key, x, y) pasted at x, y; returns the image and the button centers
+    img = np.full((SCREEN["height"], SCREEN["width"], 3), 40, dtype=np.uint8)
+    centers = {}
+    for key, x, y in buttons:
+        template = button(key)
+        h, w = template.shape[:2]
+        img[y:y + h, x:x + w] = template
+        centers[key] = (x + w // 2, y + h // 2)
+    return img, centers
+
+
+def write_session(directory, frames, windows=(), window_events=()):
+    # frames: (t, image) pairs, each one the whole screen
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for i, (t, img) in enumerate(frames):
+        filename = f"frame_{i:06d}.png"
+        cv2.imwrite(os.path.join(directory, filename), img)
+        entries.append({"file": filename, "t": t, "area": {k: SCREEN[k] for k in ("left", "top", "width", "height")}})
+    session = {"monitors": [SCREEN], "windows": [{"title": title, "rect": list(rect)} for title, rect in windows],
+               "frames": entries, "window_events": list(window_events)}
+    with open(os.path.join(directory, SESSION_FILE), "w") as f:
+        json.dump(session, f)
+    return str(directory)
+
+
+def replay_config(**fields):
+    # serial and without calibration, so runs stay deterministic and leave no scale cache
+    fields = dict(dict(detection_workers=1, match_processes=0, capture_thread=False, scale_calibration=False), **fields)
+    return ScanConfig(**fields)
@@ -0,0 +1,98 @@
+import os
+
+from main import DownloadWatcher
+
+
+def write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def started(events):
+    return [os.path.basename(path) for kind, path in events if kind == "started"]
+
+
+def finished(events):
+    return [os.path.basename(path) for kind, path in events if kind == "finished"]
+
+
+def test_existing_files_are_not_downloads(tmp_path):
+    write(tmp_path / "old.zip", 10)
+    watcher = DownloadWatcher([str(tmp_path)])
+    assert watcher.poll() == []
+    assert watcher.started == 0
+
+
+def test_chrome_rename(tmp_path):
+    watcher = DownloadWatcher([str(tmp_path)])
+    write(tmp_path / "Unconfirmed 123.crdownload", 10)
+    assert started(watcher.poll()) == ["Unconfirmed 123.crdownload"]
+    # chrome renames the partial file once the name is known, then again when it's done
+    os.rename(tmp_path / "Unconfirmed 123.crdownload", tmp_path / "mod.zip.crdownload")
+    write(tmp_path / "mod.zip.crdownload", 20)
+    assert watcher.poll() == []
+    os.rename(tmp_path / "mod.zip.crdownload", tmp_path / "mod.zip")
+    assert watcher.poll() == []
+    assert finished(watcher.poll()) == ["mod.zip"]
+    assert (watcher.started, watcher.finished) == (1, 1)
+
+
+def test_rename_by_name_without_inode(tmp_path):
+    # some filesystems don't keep the inode (or report none), the final name still matches the partial one
+    watcher = DownloadWatcher([str(tmp_path)])
+    write(tmp_path / "mod.zip.crdownload", 10)
+    assert started(watcher.poll()) == ["mod.zip.crdownload"]
+    os.remove(tmp_path / "mod.zip.crdownload")
+    write(tmp_path / "mod.zip", 10)
+    assert watcher.poll() == []
+    assert watcher.started == 1
+
+
+def test_firefox_placeholder_and_part(tmp_path):
+    watcher = DownloadWatcher([str(tmp_path)])
+    write(tmp_path / "mod.7z", 0)
+    write(tmp_path / "mod.7z.part", 10)
+    assert started(watcher.poll()) == ["mod.7z.part"]
+    write(tmp_path / "mod.7z.part", 20)
+    assert watcher.poll() == [] # the empty placeholder isn't finished
+    os.replace(tmp_path / "mod.7z.part", tmp_path / "mod.7z")
+    assert watcher.poll() == []
+    assert finished(watcher.poll()) == ["mod.7z"]
+    assert (watcher.started, watcher.finished) == (1, 1)
+
+
+def test_simultaneous_downloads(tmp_path):
+    watcher = DownloadWatcher([str(tmp_path)])
+    write(tmp_path / "a.zip.crdownload", 10)
+    write(tmp_path / "b.zip.crdownload", 10)
+    assert sorted(started(watcher.poll())) == ["a.zip.crdownload", "b.zip.crdownload"]
+    # one finishes while another one starts in the same poll
+    os.rename(tmp_path / "a.zip.crdownload", tmp_path / "a.zip")
+    write(tmp_path / "c.zip.crdownload", 10)
+    assert started(watcher.poll()) == ["c.zip.crdownload"]
+    assert finished(watcher.poll()) == ["a.zip"]
+    assert (watcher.started, watcher.finished) == (3, 1)
+
+
+def test_several_directories(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    watcher = DownloadWatcher([str(first), str(second)])
+    write(first / "a.zip.part", 10)
+    write(second / "b.zip.crdownload", 10)
+    assert sorted(started(watcher.poll())) == ["a.zip.part", "b.zip.crdownload"]
+
+
+def test_inodes_only_for_new_files(tmp_path, monkeypatch):
+    for i in range(50):
+        write(tmp_path / f"old{i}.zip", 10)
+    watcher = DownloadWatcher([str(tmp_path)])
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: stats.append(path) or real_stat(path, *args, **kwargs))
+    assert watcher.poll() == []
+    assert stats == []
+    write(tmp_path / "new.zip.part", 10)
+    assert started(watcher.poll()) == ["new.zip.part"]
+    assert [os.path.basename(path) for path in stats] == ["new.zip.part"]
@@ -0,0 +1,57 @@
+import json
+import os
+
+from conftest import replay_config, screen, write_session
+from main import (REPLAY_GRAB_COST, SESSION_FILE, SCAN_INTERVAL_CLICK_HERE, SCAN_INTERVAL_WEB, RecordingCaptureBackend,
+                  RecordingInputBackend, ReplayCaptureBackend, ReplayWindowBackend, System, VirtualClock)
+
+WEB_AT = 1.0
+CLICK_HERE_AT = 2.6
+
+
+def replay(session_dir, record_dir=None):
+    clock = VirtualClock()
+    capture = ReplayCaptureBackend(session_dir, clock)
+    window_backend = ReplayWindowBackend(capture.session)
+    if record_dir: capture = RecordingCaptureBackend(capture, record_dir, clock)
+    system = System(clock=clock, capture_backend=capture, input_backend=RecordingInputBackend(clock),
+                    window_backend=window_backend, config=replay_config())
+    if record_dir: capture.metadata = system.session_metadata()
+    system.scan_continuously()
+    return system.input_backend.events
+
+
+def mod_session(directory):
+    # the web download button, then the "click here" page after the click, as without --vortex
+    blank, _ = screen()
+    mod_page, centers = screen([("web_dl", 120, 260)])
+    slow_page, more = screen([("click_here", 300, 180)])
+    frames = [(0.0, blank), (WEB_AT, mod_page), (CLICK_HERE_AT, slow_page), (4.0, blank), (6.0, blank)]
+    return write_session(directory, frames), dict(centers, **more)
+
+
+def test_replay_clicks(workdir):
+    session_dir, centers = mod_session(workdir / "session")
+    clicks = replay(session_dir)
+    assert [c["action"] for c in clicks] == ["click", "click"]
+    assert [(c["x"], c["y"]) for c in clicks] == [centers["web_dl"], centers["click_here"]]
+    # each one on the first scan after its button shows up
+    assert WEB_AT <= clicks[0]["t"] <= WEB_AT + SCAN_INTERVAL_WEB + REPLAY_GRAB_COST
+    assert CLICK_HERE_AT <= clicks[1]["t"] <= CLICK_HERE_AT + SCAN_INTERVAL_CLICK_HERE + REPLAY_GRAB_COST
+
+
+def test_replay_is_deterministic(workdir):
+    session_dir, _ = mod_session(workdir / "session")
+    assert replay(session_dir) == replay(session_dir)
+
+
+def test_recording_replays_the_same(workdir):
+    session_dir, _ = mod_session(workdir / "session")
+    record_dir = str(workdir / "recorded")
+    clicks = replay(session_dir, record_dir)
+    assert len(clicks) == 2
+    with open(os.path.join(record_dir, SESSION_FILE)) as f:
+        recorded = json.load(f)
+    assert recorded["monitors"][0]["width"] == 800
+    assert len(recorded["frames"]) == len(os.listdir(record_dir)) - 1
+    assert replay(record_dir) == clicks
@@ -0,0 +1,84 @@
+from conftest import replay_config, screen, write_session
+from main import (EVENT_POLL_INTERVAL, RecordingInputBackend, ReplayCaptureBackend, ReplayWindowBackend,
+                  ScriptedWindowEventSource, System, VirtualClock)
+
+VORTEX_RECT = (450, 50, 800, 400)
+
+
+def replay_system(session_dir, vortex=False, events=None):
+    clock = VirtualClock()
+    capture = ReplayCaptureBackend(session_dir, clock)
+    return System(vortex=vortex, clock=clock, capture_backend=capture, input_backend=RecordingInputBackend(clock),
+                  window_backend=ReplayWindowBackend(capture.session), config=replay_config(),
+                  window_events=ScriptedWindowEventSource(clock, events, capture.start_time))
+
+
+def run_until_click(system, deadline):
+    while not system.input_backend.events and system.clock.monotonic() < deadline:
+        system.run_state_machine()
+    return system.input_backend.events
+
+
+SHOWN_AT = 2.5 # after the event burst, between two polls
+
+
+def web_session(directory, shown_at=SHOWN_AT):
+    blank, _ = screen()
+    page, centers = screen([("web_dl", 100, 300)])
+    return write_session(directory, [(0.0, blank), (shown_at, page), (10.0, page)]), centers["web_dl"]
+
+
+def test_event_wakes_the_scan_at_once(workdir):
+    # after the burst the scan only polls every EVENT_POLL_INTERVAL, the event has to cut that short
+    session_dir, center = web_session(workdir / "session")
+    system = replay_system(session_dir, events=[{"t": SHOWN_AT, "kind": "foreground", "title": "Nexus Mods - Mozilla Firefox"}])
+    clicks = run_until_click(system, 10.0)
+    assert [(c["x"], c["y"]) for c in clicks] == [center]
+    assert SHOWN_AT <= clicks[0]["t"] < SHOWN_AT + 0.1
+    assert system.event_wakeups == 1
+
+
+def test_without_events_the_scan_waits_for_the_poll(workdir):
+    session_dir, center = web_session(workdir / "session")
+    system = replay_system(session_dir)
+    clicks = run_until_click(system, 10.0)
+    assert [(c["x"], c["y"]) for c in clicks] == [center]
+    assert SHOWN_AT + 0.3 <= clicks[0]["t"] < SHOWN_AT + EVENT_POLL_INTERVAL + 0.1
+    assert system.event_wakeups == 0
+
+
+def test_irrelevant_events_dont_wake(workdir):
+    session_dir, _ = web_session(workdir / "session")
+    system = replay_system(session_dir, events=[{"t": SHOWN_AT, "kind": "create", "title": "Notepad"}])
+    clicks = run_until_click(system, 10.0)
+    assert clicks[0]["t"] >= SHOWN_AT + 0.3
+    assert system.event_wakeups == 0
+
+
+def test_missing_window_is_looked_up_after_an_event(workdir):
+    blank, _ = screen()
+    page, centers = screen([("vortex_dl", 550, 150)])
+    session_dir = write_session(workdir / "session", [(0.0, blank), (SHOWN_AT, page), (10.0, page)])
+    system = replay_system(session_dir, vortex=True, events=[{"t": SHOWN_AT, "kind": "create", "title": "Vortex"}])
+    lookups = []
+    find_window = system.window_backend.find_window
+    system.window_backend.find_window = lambda *args, **kwargs: lookups.append(args) or find_window(*args, **kwargs)
+
+    # vortex isn't open yet, it is looked up once and then not again until a window event
+    while system.clock.monotonic() < 1.0:
+        system.run_state_machine()
+    assert "vortex" in system.missing_windows
+    looked_up = len(lookups)
+    system.window_backend.windows.append(("Vortex", None, VORTEX_RECT))
+    while system.clock.monotonic() < SHOWN_AT - 0.5:
+        system.run_state_machine()
+    assert len(lookups) == looked_up
+    assert "vortex" in system.missing_windows
+
+    clicks = run_until_click(system, 10.0)
+    assert system.event_wakeups == 1
+    assert len(lookups) == looked_up + 1
+    assert "vortex" not in system.missing_windows
+    assert system.window_handles["vortex"] == len(system.window_backend.windows)
+    assert [(c["x"], c["y"]) for c in clicks] == [centers["vortex_dl"]]
+    assert SHOWN_AT <= clicks[0]["t"] < SHOWN_AT + 0.1